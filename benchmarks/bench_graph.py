@@ -0,0 +1,222 @@
+"""Benchmarks for the graph extension's hot paths: evaluation, drawing, hover snapping and data series.
+
+Runs headless on an offscreen cairo ImageSurface, so no display or GTK is needed:
+
+    python benchmarks/bench_graph.py                      # print a table
+    python benchmarks/bench_graph.py --json before.json   # also save the results
+    python benchmarks/bench_graph.py --compare before.json
+
+Each case reports the median time of one operation and a throughput figure, so two runs
+(e.g. before and after a commit) can be compared case by case with ``--compare``.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import cairo
+
+GRAPH_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "graph.py")
+spec = importlib.util.spec_from_file_location("graph", GRAPH_PATH)
+graph = importlib.util.module_from_spec(spec)
+sys.modules["graph"] = graph
+spec.loader.exec_module(graph)
+
+# Trig, poles, partial domains and a many-line codeblock.
+CORPUS = {
+    "sin": "sin(x)",
+    "poly": "x**3 - 4*x + 1",
+    "tan": "tan(x)",
+    "sqrt": "sqrt(x)",
+    "log": "log(x)",
+    "conditional": "x if x > 0 else -x",
+    "many-lines": "\n".join(f"sin({k} * x) / {k}" for k in range(1, 21)),
+}
+SAMPLE_COUNTS = [401, 4001, 40001]
+REPEAT_MODES = ["off", "horizontal", "vertical", "both"]
+DATA_ROWS = [100000, 1000000]
+WIDTH = HEIGHT = 400
+
+
+def measure(fn, min_time=0.2, min_runs=5):
+    """Median seconds per call of ``fn`` over enough runs to fill ``min_time``."""
+    fn()
+    times = []
+    start = time.perf_counter()
+    while len(times) < min_runs or time.perf_counter() - start < min_time:
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return statistics.median(times)
+
+
+def grid(count):
+    return [-10 + 20 * i / (count - 1) for i in range(count)]
+
+
+def bench_evaluation(results):
+    for name, codeblock in CORPUS.items():
+        lines = graph.codeblock_expressions(codeblock)
+        for count in SAMPLE_COUNTS:
+            x_values = grid(count)
+
+            def evaluate():
+                for line in lines:
+                    graph.CompiledExpression(line).evaluate(x_values)
+
+            seconds = measure(evaluate)
+            results[f"evaluate/{name}/{count}"] = (seconds, count * len(lines) / seconds, "points/s")
+
+        def resample():
+            for line in lines:
+                graph.adaptive_sample(graph.compile_expression(line), -10, 10, WIDTH, 20, 2000)
+
+        seconds = measure(resample)
+        results[f"adaptive/{name}"] = (seconds, len(lines) / seconds, "curves/s")
+
+
+def frame_setup(codeblock, count):
+    graphs = graph.evaluate_codeblock(codeblock, grid(count))
+    bounds = None
+    for series in graphs:
+        bounds = graph.merge_bounds(bounds, series.bounds)
+    return graphs, graph.padded_bounds(bounds)
+
+
+def bench_drawing(results):
+    surface = cairo.ImageSurface(cairo.Format.ARGB32, WIDTH, HEIGHT)
+    ctx = cairo.Context(surface)
+    for name, codeblock in CORPUS.items():
+        for count in SAMPLE_COUNTS:
+            graphs, bounds = frame_setup(codeblock, count)
+            for mode in REPEAT_MODES:
+                renderer = graph.GraphRenderer(repeat_mode=mode)
+                # Pan away from home so repeat modes have several tiles to draw.
+                view = (bounds[0] + 7, bounds[1] + 7, bounds[2], bounds[3])
+                revision = [0]
+
+                def full_frame():
+                    revision[0] += 1
+                    renderer.render(ctx, WIDTH, HEIGHT, graphs, bounds, view, data_revision=revision[0])
+
+                seconds = measure(full_frame)
+                results[f"draw/{name}/{count}/{mode}"] = (seconds, 1 / seconds, "frames/s")
+
+            renderer = graph.GraphRenderer()
+
+            def hover_frame():
+                renderer.render(ctx, WIDTH, HEIGHT, graphs, bounds, bounds, hover_pixel=(200, 200))
+
+            seconds = measure(hover_frame)
+            results[f"hover-frame/{name}/{count}"] = (seconds, 1 / seconds, "frames/s")
+
+            # A frame during a zoom gesture: the last render stretched, whatever the plot costs.
+            renderer.render(ctx, WIDTH, HEIGHT, graphs, bounds, bounds)
+            zoomed = graph.zoom_bounds(bounds, 0.8, 0, 0)
+
+            def preview_frame():
+                renderer.preview(ctx, WIDTH, HEIGHT, zoomed)
+
+            seconds = measure(preview_frame)
+            results[f"preview-frame/{name}/{count}"] = (seconds, 1 / seconds, "frames/s")
+
+
+def bench_hover(results):
+    rng = random.Random(0)
+    # A wandering pointer, like a real stream of motion events.
+    stream = []
+    x, y = WIDTH / 2, HEIGHT / 2
+    for _ in range(2000):
+        x = min(max(x + rng.uniform(-8, 8), 0), WIDTH)
+        y = min(max(y + rng.uniform(-8, 8), 0), HEIGHT)
+        stream.append((x, y))
+    for name, codeblock in CORPUS.items():
+        for count in SAMPLE_COUNTS:
+            graphs, bounds = frame_setup(codeblock, count)
+
+            def replay():
+                for px, py in stream:
+                    graph.snap_point(graphs, px, py, bounds, WIDTH, HEIGHT)
+
+            seconds = measure(replay) / len(stream)
+            results[f"motion/{name}/{count}"] = (seconds, 1 / seconds, "events/s")
+
+
+def bench_data(results):
+    rng = random.Random(0)
+    surface = cairo.ImageSurface(cairo.Format.ARGB32, WIDTH, HEIGHT)
+    ctx = cairo.Context(surface)
+    for rows in DATA_ROWS:
+        # A noisy random walk, the kind of trace that defeats naive decimation.
+        xs, ys, y = [], [], 0.0
+        for i in range(rows):
+            y += rng.gauss(0, 1)
+            xs.append(i / rows * 100)
+            ys.append(y)
+
+        def load():
+            return graph.DataSeries("data", xs, ys)
+
+        seconds = measure(load, min_runs=1)
+        results[f"data-load/{rows}"] = (seconds, rows / seconds, "rows/s")
+        series = load()
+        bounds = graph.padded_bounds(series.bounds)
+        renderer = graph.GraphRenderer()
+        frame = [0]
+        views = [(bounds[0] + k, bounds[1] - k, bounds[2], bounds[3]) for k in (0, 20, 40, 49)]
+
+        def zoom_frames():
+            for view in views:
+                frame[0] += 1
+                renderer.render(ctx, WIDTH, HEIGHT, [series], bounds, view, data_revision=frame[0])
+
+        seconds = measure(zoom_frames) / len(views)
+        results[f"data-draw/{rows}"] = (seconds, 1 / seconds, "frames/s")
+
+        def hover():
+            for px in range(0, WIDTH, 8):
+                graph.snap_point([series], px, HEIGHT / 2, bounds, WIDTH, HEIGHT)
+
+        seconds = measure(hover) / (WIDTH // 8)
+        results[f"data-motion/{rows}"] = (seconds, 1 / seconds, "events/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", help="Save results to this file")
+    parser.add_argument("--compare", help="Show the change against results saved with --json")
+    parser.add_argument("--only", choices=["evaluation", "drawing", "hover", "data"], action="append",
+                        help="Run only these groups (can be repeated)")
+    args = parser.parse_args(argv)
+
+    groups = {"evaluation": bench_evaluation, "drawing": bench_drawing, "hover": bench_hover, "data": bench_data}
+    results = {}
+    for name in args.only or groups:
+        groups[name](results)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    for case, (seconds, throughput, unit) in results.items():
+        line = f"{case:<40} {seconds * 1000:10.3f} ms {throughput:14.1f} {unit}"
+        if case in baseline:
+            change = (seconds / baseline[case]["seconds"] - 1) * 100
+            line += f"  {change:+6.1f}%"
+        print(line)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "numpy": graph.np is not None,
+                "results": {case: {"seconds": seconds, "throughput": throughput, "unit": unit}
+                            for case, (seconds, throughput, unit) in results.items()},
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,2025 @@
-from .extensions import NewelleExtension
+from __future__ import annotations
+
+try:
+    from .extensions import NewelleExtension
+except ImportError:
+    # Loaded outside Newelle, e.g. by the ``render`` command line at the bottom of this file.
+    NewelleExtension = object
 from typing import List
+import argparse
+import ast
+import bisect
+import collections
+import contextlib
+import functools
+import hashlib
 import math
+import mmap
+import multiprocessing
+import os
+import pickle
+import re
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import threading
-from gi.repository import Gtk, GLib, cairo
+import cairo
+
+try:
+    from gi.repository import Gtk, Gdk, GLib, Gio
+except ImportError:
+    # Headless use: rendering to files only needs cairo.
+    Gtk = Gdk = GLib = Gio = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Names an expression may use, mapped for per-point (math) and batch (NumPy) evaluation.
+SCALAR_NAMESPACE = {
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "sqrt": math.sqrt,
+    "log": math.log,
+    "abs": abs,
+    "pi": math.pi,
+    "e": math.e,
+}
+VECTOR_NAMESPACE = {
+    "sin": np.sin,
+    "cos": np.cos,
+    "tan": np.tan,
+    "sqrt": np.sqrt,
+    "log": np.log,
+    "abs": abs,
+    "pi": math.pi,
+    "e": math.e,
+} if np is not None else None
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+    ast.Call, ast.Name, ast.Load, ast.Constant,
+    ast.operator, ast.unaryop, ast.boolop, ast.cmpop,
+)
+
+
+class CompiledExpression:
+    """A graph expression parsed and validated once, then evaluated over whole arrays of x.
+
+    ``variables`` are the names the expression may use besides the math functions: x and any
+    parameters, whose values are passed to the evaluate methods as a mapping or (name, value) pairs.
+    """
+
+    def __init__(self, source: str, variables=("x",)):
+        self.source = source
+        self.variables = tuple(variables)
+        # Spacing and redundant parentheses don't change the result; used as a cache key.
+        self.normalized = source.strip()
+        self.names = frozenset()
+        self.code = None
+        self.error = None
+        try:
+            tree = ast.parse(source, mode="eval")
+            self.normalized = ast.unparse(tree)
+            self.names = frozenset(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))
+            allowed_names = set(SCALAR_NAMESPACE) | set(self.variables)
+            for node in ast.walk(tree):
+                if not isinstance(node, _ALLOWED_NODES):
+                    raise ValueError(f"unsupported syntax: {type(node).__name__}")
+                if isinstance(node, ast.Name) and node.id not in allowed_names:
+                    raise ValueError(f"unknown name: {node.id}")
+                if isinstance(node, ast.Call) and not isinstance(node.func, ast.Name):
+                    raise ValueError("only named functions can be called")
+            self.code = compile(tree, "<graph>", "eval")
+        except (SyntaxError, ValueError) as e:
+            self.error = str(e)
+
+    @property
+    def valid(self) -> bool:
+        return self.code is not None
+
+    def bind(self, params) -> tuple:
+        """The (name, value) pairs of ``params`` this expression uses, in a stable order."""
+        return tuple(sorted((name, value) for name, value in dict(params).items() if name in self.names))
+
+    def evaluate(self, x_values, params=()):
+        """Return (xs, ys) for the x values where the expression yields a finite real number."""
+        ys = self.evaluate_aligned(x_values, params)
+        if np is not None and isinstance(ys, np.ndarray):
+            xs = np.asarray(x_values, dtype=float)
+            mask = np.isfinite(ys)
+            return xs[mask], ys[mask]
+        kept = [(x, y) for x, y in zip(x_values, ys) if not math.isnan(y)]
+        return [x for x, _ in kept], [y for _, y in kept]
+
+    def evaluate_aligned(self, x_values, params=()):
+        """Return one y per x value, NaN wherever the expression is undefined or not finite.
+
+        The values are bound to the first of ``variables``.
+        """
+        return self.evaluate_many({self.variables[0]: x_values}, params)
+
+    def evaluate_many(self, columns, params=()):
+        """Like ``evaluate_aligned`` for several sampled variables, e.g. {"x": xs, "y": ys}.
+
+        Every column must have the same length; one result is returned per row.
+        """
+        length = len(next(iter(columns.values())))
+        if self.code is None:
+            return [math.nan] * length
+        params = dict(params)
+        if np is not None:
+            try:
+                return self._evaluate_vector({name: np.asarray(values, dtype=float)
+                                              for name, values in columns.items()}, params)
+            except Exception:
+                # Constructs NumPy can't broadcast (e.g. conditionals) fall back to per-point.
+                pass
+        return self._evaluate_scalar(columns, params)
+
+    def _evaluate_vector(self, columns, params):
+        with np.errstate(all="ignore"):
+            ys = eval(self.code, {"__builtins__": None}, {**VECTOR_NAMESPACE, **params, **columns})
+        ys = np.asarray(ys)
+        if ys.dtype.kind not in "biuf":
+            raise TypeError("expression did not produce real numbers")
+        ys = np.array(np.broadcast_to(ys.astype(float), next(iter(columns.values())).shape))
+        ys[~np.isfinite(ys)] = np.nan
+        return ys
+
+    def _evaluate_scalar(self, columns, params):
+        ys = []
+        local_vars = {**SCALAR_NAMESPACE, **params}
+        names = list(columns)
+        for row in zip(*columns.values()):
+            local_vars.update(zip(names, row))
+            try:
+                y = eval(self.code, {"__builtins__": None}, local_vars)
+                if isinstance(y, (int, float)) and not math.isinf(y) and not math.isnan(y):
+                    ys.append(y)
+                    continue
+            except Exception:
+                pass
+            ys.append(math.nan)
+        return ys
+
+
+def adaptive_sample(compiled: CompiledExpression, x_min: float, x_max: float,
+                    width: int, y_scale: float, budget: int, tolerance: float = 0.5, params=()):
+    """Sample ``compiled`` over [x_min, x_max], subdividing where the curve bends or breaks.
+
+    ``width`` is the number of pixels the domain spans and ``y_scale`` the pixels per y unit,
+    so refinement decisions are made in screen space. Intervals whose midpoint strays more than
+    ``tolerance`` pixels from the chord, or whose ends disagree on being defined, are split
+    first, largest error first, until ``budget`` points are used or every interval is flat.
+    Returns (xs, ys) with undefined points dropped, like ``CompiledExpression.evaluate``.
+    """
+    if x_max <= x_min or budget < 2:
+        return compiled.evaluate([], params)
+    count = max(2, min(budget // 2, width // 2 + 1))
+    step = (x_max - x_min) / (count - 1)
+    xs = [x_min + i * step for i in range(count)]
+    ys = list(compiled.evaluate_aligned(xs, params))
+    min_dx = (x_max - x_min) / max(width, 1) / 64
+    while len(xs) < budget:
+        mids = []
+        for i in range(len(xs) - 1):
+            if xs[i + 1] - xs[i] > min_dx:
+                mids.append((i, (xs[i] + xs[i + 1]) / 2))
+        if not mids:
+            break
+        mid_ys = compiled.evaluate_aligned([m for _, m in mids], params)
+        candidates = []
+        for (i, mx), my in zip(mids, mid_ys):
+            y0, y1 = ys[i], ys[i + 1]
+            defined = (not math.isnan(y0), not math.isnan(my), not math.isnan(y1))
+            if all(defined):
+                error = abs(my - (y0 + y1) / 2) * y_scale
+            elif any(defined):
+                error = math.inf
+            else:
+                continue
+            if error > tolerance:
+                candidates.append((error, i, mx, float(my)))
+        if not candidates:
+            break
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        candidates = sorted(candidates[:budget - len(xs)], key=lambda c: c[1])
+        new_xs, new_ys, prev = [], [], 0
+        for _, i, mx, my in candidates:
+            new_xs += xs[prev:i + 1]
+            new_ys += ys[prev:i + 1]
+            new_xs.append(mx)
+            new_ys.append(my)
+            prev = i + 1
+        xs = new_xs + xs[prev:]
+        ys = new_ys + list(ys[prev:])
+    kept = [(x, y) for x, y in zip(xs, ys) if not math.isnan(y)]
+    return [x for x, _ in kept], [y for _, y in kept]
+
+
+def _segment_crossings(f0, f1, x0, y0, x1, y1):
+    """Where the segment from (x0, y0) to (x1, y1) crosses zero, given the values at its ends."""
+    t = f0 / (f0 - f1)
+    return x0 + t * (x1 - x0), y0 + t * (y1 - y0)
+
+
+def contour_segments(compiled: CompiledExpression, view_bounds, width, height, params=(),
+                     base_cells=32, min_cell=2):
+    """Trace ``compiled(x, y) = 0`` over ``view_bounds`` with marching squares on a quadtree.
+
+    A ``base_cells`` x ``base_cells`` grid covers the view. Cells whose corners or center change
+    sign are split into four, level by level, until cells are about ``min_cell`` pixels wide.
+    Each level is evaluated in one batch, so the work follows the length of the curve rather
+    than the area of the view. Segments whose midpoint isn't close to zero (poles such as
+    ``1/x = y``) are dropped. Returns (xs, ys): two points per segment, each followed by NaN.
+    """
+    x_min, x_max, y_min, y_max = view_bounds
+    cell_w = (x_max - x_min) / base_cells
+    cell_h = (y_max - y_min) / base_cells
+    depth = max(0, math.ceil(math.log2(max(width, height, 1) / base_cells / min_cell)))
+    if np is not None:
+        lefts, bottoms = np.meshgrid(x_min + np.arange(base_cells) * cell_w, y_min + np.arange(base_cells) * cell_h)
+        lefts, bottoms = lefts.ravel(), bottoms.ravel()
+        for level in range(depth + 1):
+            # Corners counter-clockwise from the bottom left, then the center.
+            rights, tops = lefts + cell_w, bottoms + cell_h
+            values = np.asarray(compiled.evaluate_many({
+                "x": np.concatenate([lefts, rights, rights, lefts, lefts + cell_w / 2]),
+                "y": np.concatenate([bottoms, bottoms, tops, tops, bottoms + cell_h / 2]),
+            }, params), dtype=float).reshape(5, -1)
+            finite = np.isfinite(values)
+            positive = values > 0
+            active = (finite & positive).any(axis=0) & (finite & ~positive).any(axis=0)
+            lefts, bottoms, values = lefts[active], bottoms[active], values[:, active]
+            if level == depth or not len(lefts):
+                break
+            cell_w /= 2
+            cell_h /= 2
+            lefts = np.concatenate([lefts, lefts + cell_w, lefts, lefts + cell_w])
+            bottoms = np.concatenate([bottoms, bottoms, bottoms + cell_h, bottoms + cell_h])
+        f00, f10, f11, f01, center = values
+        rights, tops = lefts + cell_w, bottoms + cell_h
+        edges = [(f00, f10, lefts, bottoms, rights, bottoms), (f10, f11, rights, bottoms, rights, tops),
+                 (f01, f11, lefts, tops, rights, tops), (f00, f01, lefts, bottoms, lefts, tops)]
+        with np.errstate(all="ignore"):
+            crossed = np.array([np.isfinite(a) & np.isfinite(b) & ((a > 0) != (b > 0)) for a, b, *_ in edges])
+            points = [_segment_crossings(*edge) for edge in edges]
+        px = np.array([x for x, _ in points])
+        py = np.array([y for _, y in points])
+        count = crossed.sum(axis=0)
+        cells = np.arange(len(lefts))
+        # Two crossings: one segment between them. Four (a saddle): the center decides which
+        # pairs of edges to join.
+        single = count == 2
+        first = np.argmax(crossed, axis=0)
+        second = 3 - np.argmax(crossed[::-1], axis=0)
+        saddle = count == 4
+        joined = (center > 0) == (f00 > 0)
+        bottom = np.zeros(len(cells), dtype=np.int64)
+        pairs = [(first, second, single),
+                 (bottom, np.where(joined, 1, 3), saddle),
+                 (bottom + 2, np.where(joined, 3, 1), saddle)]
+        starts_x, starts_y, ends_x, ends_y = [], [], [], []
+        for a, b, mask in pairs:
+            starts_x.append(px[a[mask], cells[mask]])
+            starts_y.append(py[a[mask], cells[mask]])
+            ends_x.append(px[b[mask], cells[mask]])
+            ends_y.append(py[b[mask], cells[mask]])
+        x0, y0, x1, y1 = (np.concatenate(parts) for parts in (starts_x, starts_y, ends_x, ends_y))
+        limits = np.concatenate([np.nanmax(np.abs(values[:4, mask]), axis=0) if mask.any() else np.empty(0)
+                                 for _, _, mask in pairs])
+        middle = np.abs(np.asarray(compiled.evaluate_many({"x": (x0 + x1) / 2, "y": (y0 + y1) / 2}, params)))
+        kept = middle <= limits
+        gaps = np.full(int(kept.sum()), np.nan)
+        return (np.stack([x0[kept], x1[kept], gaps], axis=1).ravel(),
+                np.stack([y0[kept], y1[kept], gaps], axis=1).ravel())
+
+    cells = [(x_min + i * cell_w, y_min + j * cell_h) for j in range(base_cells) for i in range(base_cells)]
+    values = []
+    for level in range(depth + 1):
+        xs, ys = [], []
+        for left, bottom in cells:
+            xs += [left, left + cell_w, left + cell_w, left, left + cell_w / 2]
+            ys += [bottom, bottom, bottom + cell_h, bottom + cell_h, bottom + cell_h / 2]
+        flat = compiled.evaluate_many({"x": xs, "y": ys}, params)
+        values = [flat[5 * k:5 * k + 5] for k in range(len(cells))]
+        active = [k for k, cell_values in enumerate(values)
+                  if any(v > 0 for v in cell_values) and any(v <= 0 for v in cell_values)]
+        cells = [cells[k] for k in active]
+        values = [values[k] for k in active]
+        if level == depth or not cells:
+            break
+        cell_w /= 2
+        cell_h /= 2
+        cells = [(left + dx, bottom + dy) for left, bottom in cells for dy in (0, cell_h) for dx in (0, cell_w)]
+    segments = []
+    for (left, bottom), (f00, f10, f11, f01, center) in zip(cells, values):
+        right, top = left + cell_w, bottom + cell_h
+        edges = [(f00, f10, left, bottom, right, bottom), (f10, f11, right, bottom, right, top),
+                 (f01, f11, left, top, right, top), (f00, f01, left, bottom, left, top)]
+        crossed = [k for k, (a, b, *_) in enumerate(edges)
+                   if not (math.isnan(a) or math.isnan(b)) and (a > 0) != (b > 0)]
+        if len(crossed) == 2:
+            pairs = [crossed]
+        elif len(crossed) == 4:
+            pairs = [(0, 1), (2, 3)] if (center > 0) == (f00 > 0) else [(0, 3), (2, 1)]
+        else:
+            continue
+        limit = max(abs(v) for v in (f00, f10, f11, f01) if not math.isnan(v))
+        for a, b in pairs:
+            segments.append((_segment_crossings(*edges[a]), _segment_crossings(*edges[b]), limit))
+    middles = compiled.evaluate_many({"x": [(p[0] + q[0]) / 2 for p, q, _ in segments],
+                                      "y": [(p[1] + q[1]) / 2 for p, q, _ in segments]}, params) if segments else []
+    xs, ys = array("d"), array("d")
+    for (start, end, limit), middle in zip(segments, middles):
+        if abs(middle) <= limit:
+            xs.extend((start[0], end[0], math.nan))
+            ys.extend((start[1], end[1], math.nan))
+    return xs, ys
+
+
+SHAPE_RANGE = re.compile(r"(.+?)\s+for\s+(t|theta)\s+in\s*\[(.+),(.+)\]$")
+POLAR_LINE = re.compile(r"r\s*=(?!=)\s*(.+)$")
+# An "=" that isn't part of ==, <=, >= or !=.
+EQUATION_SIGN = re.compile(r"(?<![<>=!])=(?!=)")
+
+
+class ShapeExpression:
+    """An implicit equation, parametric pair or polar curve, parsed once and traced in batches.
+
+    ``kind`` is "implicit" (``f(x, y) = g(x, y)``), "parametric" (``(x(t), y(t))``) or "polar"
+    (``r = f(theta)``), or None if ``source`` is none of them. Parametric and polar curves may
+    end with ``for t in [a, b]`` (or ``theta``); the default range is [0, 2*pi]. ``explicit``
+    is the right-hand side of an implicit ``y = f(x)``, which is better plotted as a function.
+    """
+
+    def __init__(self, source: str, params=()):
+        self.source = source
+        self.kind = None
+        self.parts = []
+        self.domain = (0.0, 2 * math.pi)
+        self.explicit = None
+        text = source.strip()
+        variable = None
+        match = SHAPE_RANGE.match(text)
+        if match is not None:
+            text, variable = match.group(1).strip(), match.group(2)
+            bounds = [compile_expression(bound.strip()).evaluate_aligned([0.0])[0] for bound in match.group(3, 4)]
+            if not any(math.isnan(bound) for bound in bounds):
+                self.domain = tuple(float(bound) for bound in bounds)
+        polar = POLAR_LINE.match(text)
+        sides = [side.strip() for side in EQUATION_SIGN.split(text)]
+        if polar is not None and variable in (None, "theta"):
+            self.kind = "polar"
+            self.parts = [CompiledExpression(polar.group(1), ("theta",) + tuple(params))]
+        elif variable in (None, "t") and self._pair(text) is not None:
+            self.kind = "parametric"
+            self.parts = [CompiledExpression(ast.unparse(elt), ("t",) + tuple(params)) for elt in self._pair(text)]
+        elif len(sides) == 2 and variable is None:
+            self.kind = "implicit"
+            self.parts = [CompiledExpression(f"({sides[0]}) - ({sides[1]})", ("x", "y") + tuple(params))]
+            if sides[0] == "y" and "y" not in CompiledExpression(sides[1], ("x", "y")).names:
+                self.explicit = sides[1]
+        self.names = frozenset().union(*(part.names for part in self.parts))
+        self.normalized = f"{self.kind}: {', '.join(part.normalized for part in self.parts)} {self.domain}"
+        self.error = next((part.error for part in self.parts if part.error), None)
+
+    @staticmethod
+    def _pair(text):
+        """The two elements of a parenthesised ``(x(t), y(t))`` pair, or None.
+
+        Implicit equations often start with a parenthesis too, e.g. ``(x-1)**2 + y**2 = 9``.
+        """
+        if not text.startswith("("):
+            return None
+        try:
+            tree = ast.parse(text, mode="eval").body
+        except SyntaxError:
+            return None
+        if isinstance(tree, ast.Tuple) and len(tree.elts) == 2:
+            return tree.elts
+        return None
+
+    @property
+    def valid(self) -> bool:
+        return self.kind is not None and self.error is None
+
+    @property
+    def view_dependent(self) -> bool:
+        """Implicit curves are traced for a viewport and again whenever it changes."""
+        return self.kind == "implicit"
+
+    def bind(self, params) -> tuple:
+        """The (name, value) pairs of ``params`` this shape uses, in a stable order."""
+        return tuple(sorted((name, value) for name, value in dict(params).items() if name in self.names))
+
+    def trace(self, view_bounds, width, height, params=(), samples=4096):
+        """Return (xs, ys) along the shape, with NaN where the pen lifts.
+
+        Parametric and polar curves take ``samples`` evenly spaced values of their parameter;
+        implicit ones are contoured over ``view_bounds`` at the resolution of ``width`` x ``height``.
+        """
+        if self.kind == "implicit":
+            return contour_segments(self.parts[0], view_bounds, width, height, params)
+        start, end = self.domain
+        if np is not None:
+            ts = np.linspace(start, end, samples)
+        else:
+            ts = [start + (end - start) * i / (samples - 1) for i in range(samples)]
+        values = [part.evaluate_aligned(ts, params) for part in self.parts]
+        if self.kind == "parametric":
+            return float_buffer(values[0]), float_buffer(values[1])
+        radii = values[0]
+        if np is not None:
+            return radii * np.cos(ts), radii * np.sin(ts)
+        return (array("d", (r * math.cos(t) for r, t in zip(radii, ts))),
+                array("d", (r * math.sin(t) for r, t in zip(radii, ts))))
+
+
+@functools.lru_cache(maxsize=256)
+def compile_expression(source: str, params=()) -> CompiledExpression:
+    """Shared compiled form of ``source`` using the parameter names ``params``, so pool workers
+    parse each expression once."""
+    return CompiledExpression(source, ("x",) + tuple(params))
+
+
+def evaluate_task(source, x_values, params=()):
+    """Pool task: evaluate one expression over a chunk of x values, returning (xs, ys).
+
+    ``params`` are the (name, value) pairs from ``CompiledExpression.bind``.
+    """
+    return compile_expression(source, tuple(name for name, _ in params)).evaluate(x_values, params)
+
+
+def resample_task(source, x_min, x_max, width, y_scale, budget, params=()):
+    """Pool task: ``adaptive_sample`` for one expression, returning (xs, ys)."""
+    compiled = compile_expression(source, tuple(name for name, _ in params))
+    return adaptive_sample(compiled, x_min, x_max, width, y_scale, budget, params=params)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_shape(source: str, params=()) -> ShapeExpression:
+    """Shared parsed form of an implicit, parametric or polar line, like ``compile_expression``."""
+    return ShapeExpression(source, params)
+
+
+def shape_task(source, view_bounds, width, height, params=()):
+    """Pool task: trace one implicit, parametric or polar line, returning (xs, ys) with NaN gaps."""
+    return compile_shape(source, tuple(name for name, _ in params)).trace(view_bounds, width, height, params)
+
+
+def concat_buffers(chunks):
+    """Join per-chunk sample buffers back into one sequence."""
+    if np is not None:
+        return np.concatenate([np.asarray(chunk, dtype=float) for chunk in chunks])
+    joined = []
+    for chunk in chunks:
+        joined.extend(chunk)
+    return joined
+
+
+# Largest number of x values evaluated by a single pool task.
+EVALUATION_CHUNK_SIZE = 4096
+# The first, coarse pass of a curve evaluates every COARSE_STRIDE-th x value of the grid.
+COARSE_STRIDE = 10
+
+
+class PoolJob:
+    """A batch of tasks submitted to an ``EvaluationPool`` on behalf of one widget.
+
+    ``on_result(index, result)`` is called from a pool thread for each finished task, with the
+    exception instead of a result if the task raised. Nothing is reported after ``cancel``.
+    """
+
+    def __init__(self, tasks, on_result, is_visible=None):
+        self.pending = collections.deque(enumerate(tasks))
+        self.on_result = on_result
+        self.is_visible = is_visible or (lambda: True)
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        self.pending.clear()
+
+
+class EvaluationPool:
+    """Bounded worker pool shared by every graph widget of the extension.
+
+    Tasks are module-level functions with picklable arguments, run in worker threads or, with
+    ``processes``, in forked worker processes so evaluation isn't serialised by the GIL. A
+    dispatcher thread keeps at most ``max_workers`` tasks in flight and always serves jobs of
+    visible widgets before hidden ones. If the process pool can't be used (a task can't be
+    pickled, or a worker dies) it falls back to threads for good; exceptions raised by the
+    tasks themselves are just reported.
+    """
+
+    TRANSPORT_ERRORS = (pickle.PicklingError, BrokenProcessPool)
+
+    def __init__(self, max_workers=None, processes=False):
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.processes = processes
+        self._executor = None
+        self._jobs = []
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._dispatcher = None
+
+    def submit(self, tasks, on_result, is_visible=None) -> PoolJob:
+        """Queue ``tasks``, a list of (function, args) pairs, and return the job handle."""
+        job = PoolJob(tasks, on_result, is_visible)
+        with self._cond:
+            self._jobs.append(job)
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name="GraphPoolDispatcher", daemon=True)
+                self._dispatcher.start()
+            self._cond.notify()
+        return job
+
+    def _executor_for_submit(self):
+        if self._executor is None:
+            if self.processes:
+                # fork keeps the already imported extension module available to the workers.
+                self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("fork"))
+            else:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="GraphWorker")
+        return self._executor
+
+    @staticmethod
+    def _visible(job):
+        try:
+            return job.is_visible()
+        except Exception:
+            return False
+
+    def _next_task(self):
+        while True:
+            self._jobs = [job for job in self._jobs if job.pending]
+            if not self._jobs:
+                return None
+            job = next((job for job in self._jobs if self._visible(job)), self._jobs[0])
+            try:
+                return job, job.pending.popleft()
+            except IndexError:
+                # Cancelled from the main thread since the check above; pick again.
+                continue
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                picked = None
+                while picked is None:
+                    if self._in_flight < self.max_workers:
+                        picked = self._next_task()
+                    if picked is None:
+                        self._cond.wait()
+                self._in_flight += 1
+                try:
+                    executor = self._executor_for_submit()
+                except Exception:
+                    # The dispatcher serves every widget of the session, so it must not die here.
+                    self.processes = False
+                    executor = self._executor_for_submit()
+            # In a helper so the job, whose callback refers to its widget, isn't kept alive
+            # by this frame while the dispatcher waits for the next one.
+            self._submit(executor, *picked)
+
+    def _submit(self, executor, job, task):
+        index, (fn, args) = task
+        try:
+            future = executor.submit(fn, *args)
+        except Exception as e:
+            self._finished(job, index, fn, args, executor, error=e)
+            return
+        future.add_done_callback(functools.partial(self._finished, job, index, fn, args, executor))
+
+    def _finished(self, job, index, fn, args, executor, future=None, error=None):
+        result = error
+        if future is not None:
+            try:
+                result = future.result()
+            except Exception as e:
+                result = e
+        retry = False
+        with self._cond:
+            self._in_flight -= 1
+            if isinstance(result, self.TRANSPORT_ERRORS) and isinstance(executor, ProcessPoolExecutor):
+                if self._executor is executor:
+                    self.processes = False
+                    self._executor = None
+                    executor.shutdown(wait=False, cancel_futures=True)
+                retry = not job.cancelled
+                if retry:
+                    job.pending.appendleft((index, (fn, args)))
+                    if job not in self._jobs:
+                        self._jobs.append(job)
+            self._cond.notify()
+        if not retry and not job.cancelled:
+            try:
+                job.on_result(index, result)
+            except Exception:
+                # Also runs on the dispatcher thread, which must survive a failing callback.
+                pass
+
+
+class ResultCache:
+    """LRU cache of evaluated (xs, ys) samples, shared by every graph widget.
+
+    Entries are bounded by the total size of their buffers. With a ``directory``, entries of
+    the ``PERSISTENT`` kinds are also written there by a background thread and read back on a
+    memory miss, so results survive restarts; the directory is trimmed to ``max_bytes`` too,
+    oldest files first. ``stats()`` reports hit and miss counters.
+    """
+
+    # Only whole-grid evaluations are worth keeping: resampled and traced entries are keyed
+    # on continuous view bounds, so every pan or zoom would add a file nobody reads again.
+    PERSISTENT = ("grid",)
+
+    def __init__(self, max_bytes, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._writer = None
+        # Bytes in the directory, counted on the first write and tracked from then on.
+        self._disk_size = None
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + ".bin")
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        if self.directory is not None and key[0] in self.PERSISTENT:
+            try:
+                path = self._path(key)
+                with open(path, "rb") as f:
+                    data = array("d")
+                    data.frombytes(f.read())
+                # Trimming removes the least recently used files first.
+                os.utime(path)
+                count = int(data[0])
+                entry = (float_buffer(data[1:count + 1]), float_buffer(data[count + 1:]))
+                self._store(key, entry)
+                self.disk_hits += 1
+                return entry
+            except (OSError, ValueError, IndexError):
+                pass
+        self.misses += 1
+        return None
+
+    def put(self, key, xs, ys):
+        entry = (float_buffer(xs), float_buffer(ys))
+        self._store(key, entry)
+        if self.directory is not None and key[0] in self.PERSISTENT:
+            # Called from the GTK main loop, so the file is written elsewhere. Cached buffers
+            # are never modified, so the writer can read them as they are.
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(1, thread_name_prefix="GraphCacheWriter")
+            self._writer.submit(self._write, self._path(key), entry)
+
+    def _write(self, path, entry):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            data = array("d", [len(entry[0])])
+            data.extend(entry[0])
+            data.extend(entry[1])
+            with open(path + ".tmp", "wb") as f:
+                data.tofile(f)
+            os.replace(path + ".tmp", path)
+            if self._disk_size is None:
+                self._disk_size = sum(item.stat().st_size for item in os.scandir(self.directory)
+                                      if item.name.endswith(".bin"))
+            else:
+                self._disk_size += 8 * len(data)
+            if self._disk_size > self.max_bytes:
+                self._trim()
+        except OSError:
+            pass
+
+    def _trim(self):
+        files = sorted((item.stat().st_mtime, item.stat().st_size, item.path)
+                       for item in os.scandir(self.directory) if item.name.endswith(".bin"))
+        total = sum(size for _, size, _ in files)
+        # Down to three quarters, so the next few writes don't each scan the directory again.
+        for _, size, path in files:
+            if total <= self.max_bytes * 3 // 4:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._disk_size = total
+
+    def _store(self, key, entry):
+        if key in self.entries:
+            self.size -= self._nbytes(self.entries.pop(key))
+        self.entries[key] = entry
+        self.size += self._nbytes(entry)
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= self._nbytes(evicted)
+
+    @staticmethod
+    def _nbytes(entry):
+        return 8 * (len(entry[0]) + len(entry[1]))
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "bytes": self.size,
+        }
+
+
+def series_bounds(xs, ys):
+    """Return (min_x, max_x, min_y, max_y) of a series, or None if it has no points."""
+    if len(xs) == 0:
+        return None
+    if np is not None and isinstance(xs, np.ndarray):
+        return float(xs.min()), float(xs.max()), float(ys.min()), float(ys.max())
+    return min(xs), max(xs), min(ys), max(ys)
+
+
+def merge_bounds(a, b):
+    """Union of two bounds tuples, either of which may be None."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+
+
+def padded_bounds(bounds, margin=0.1):
+    """Bounds to display for the given data bounds: 10% margin, at least one unit per axis."""
+    if bounds is None:
+        bounds = (-10, 10, -10, 10)
+    min_x, max_x, min_y, max_y = bounds
+    x_range = max(abs(max_x - min_x), 1)
+    y_range = max(abs(max_y - min_y), 1)
+    return (min_x - margin * x_range, max_x + margin * x_range,
+            min_y - margin * y_range, max_y + margin * y_range)
+
+
+# Touchpad scrolling, in pixels, that zooms as much as one mouse wheel notch.
+SCROLL_PIXELS_PER_NOTCH = 50
+
+
+def zoom_bounds(bounds, factor, anchor_x, anchor_y):
+    """Scale ``bounds`` by ``factor`` about the point (anchor_x, anchor_y), which stays put on screen."""
+    min_x, max_x, min_y, max_y = bounds
+    return (anchor_x + (min_x - anchor_x) * factor, anchor_x + (max_x - anchor_x) * factor,
+            anchor_y + (min_y - anchor_y) * factor, anchor_y + (max_y - anchor_y) * factor)
+
+
+def float_buffer(values):
+    """Contiguous float64 storage for samples: a NumPy array if available, else array('d')."""
+    if np is not None:
+        return np.ascontiguousarray(values, dtype=float)
+    if isinstance(values, array) and values.typecode == "d":
+        return values
+    return array("d", values)
+
+
+class PointIndex:
+    """Points of one curve sorted by x, so hover only inspects the few columns near the cursor.
+
+    Sorting happens once when the points arrive; lookups bisect into the slice of points whose
+    screen x lies within the snap threshold, so they don't depend on the current view.
+    """
+
+    def __init__(self, xs, ys):
+        if np is not None:
+            if len(xs) > 1 and not bool(np.all(xs[1:] >= xs[:-1])):
+                order = np.argsort(xs, kind="stable")
+                xs, ys = xs[order], ys[order]
+        elif any(xs[i] > xs[i + 1] for i in range(len(xs) - 1)):
+            order = sorted(range(len(xs)), key=xs.__getitem__)
+            xs, ys = array("d", (xs[i] for i in order)), array("d", (ys[i] for i in order))
+        self.xs = xs
+        self.ys = ys
+
+    def nearest(self, x, y, view_bounds, width, height, max_dist):
+        """Return (point, pixel, dist) of the closest point to pixel (x, y) under ``max_dist``.
+
+        Returns None when no point is strictly closer than ``max_dist``.
+        """
+        view_min_x, view_max_x, view_min_y, view_max_y = view_bounds
+        x_scale = width / (view_max_x - view_min_x)
+        y_scale = height / (view_max_y - view_min_y)
+        center_x = view_min_x + x / x_scale
+        reach = max_dist / x_scale
+        lo = bisect.bisect_left(self.xs, center_x - reach)
+        hi = bisect.bisect_right(self.xs, center_x + reach)
+        if lo >= hi:
+            return None
+        if np is not None:
+            txs = (self.xs[lo:hi] - view_min_x) * x_scale
+            tys = height - (self.ys[lo:hi] - view_min_y) * y_scale
+            dists = np.hypot(txs - x, tys - y)
+            i = int(np.argmin(dists))
+            if dists[i] >= max_dist:
+                return None
+            return ((float(self.xs[lo + i]), float(self.ys[lo + i])),
+                    (float(txs[i]), float(tys[i])), float(dists[i]))
+        best = None
+        for pt_x, pt_y in zip(self.xs[lo:hi], self.ys[lo:hi]):
+            tx = (pt_x - view_min_x) * x_scale
+            ty = height - (pt_y - view_min_y) * y_scale
+            dist = math.hypot(tx - x, ty - y)
+            if dist < max_dist:
+                max_dist = dist
+                best = ((pt_x, pt_y), (tx, ty), dist)
+        return best
+
+
+def to_screen(xs, ys, view_bounds, width, height, offset_x=0, offset_y=0):
+    """Transform sample buffers to pixel coordinates in one batch; returns (txs, tys) lists."""
+    view_min_x, view_max_x, view_min_y, view_max_y = view_bounds
+    x_scale = width / (view_max_x - view_min_x)
+    y_scale = height / (view_max_y - view_min_y)
+    if np is not None:
+        txs = (xs + (offset_x - view_min_x)) * x_scale
+        tys = height - (ys + (offset_y - view_min_y)) * y_scale
+        return txs.tolist(), tys.tolist()
+    return ([(x + offset_x - view_min_x) * x_scale for x in xs],
+            [height - (y + offset_y - view_min_y) * y_scale for y in ys])
+
+
+def decimate_polyline(txs, tys, breaks):
+    """Reduce a screen-space polyline to at most four points per pixel column per run.
+
+    ``txs`` must be non-decreasing; ``breaks[i]`` is true where the pen lifts between points
+    i - 1 and i. Within each pixel column of a run, the first, lowest, highest and last points
+    are kept in their original order, which draws the same pixels as the full polyline.
+    Returns a list of runs, each a (xs, ys) pair of lists.
+    """
+    n = len(txs)
+    if n == 0:
+        return []
+    if np is not None:
+        txs = np.asarray(txs)
+        tys = np.asarray(tys)
+        columns = np.floor(txs).astype(np.int64)
+        starts = np.asarray(breaks, dtype=bool).copy()
+        starts[0] = True
+        starts[1:] |= columns[1:] != columns[:-1]
+        groups = np.cumsum(starts) - 1
+        order = np.lexsort((tys, groups))
+        sorted_groups = groups[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+        group_ends = np.r_[group_starts[1:], n] - 1
+        first = np.flatnonzero(starts)
+        last = np.r_[first[1:], n] - 1
+        keep = np.zeros(n, dtype=bool)
+        keep[first] = keep[last] = keep[order[group_starts]] = keep[order[group_ends]] = True
+        kept = np.flatnonzero(keep)
+        run_starts = np.flatnonzero(np.asarray(breaks, dtype=bool)[kept])
+        runs = []
+        for run in np.split(kept, run_starts):
+            if len(run):
+                runs.append((txs[run].tolist(), tys[run].tolist()))
+        return runs
+
+    runs = []
+    run_x, run_y = [], []
+    group = []
+
+    def flush_group():
+        lowest = min(group, key=tys.__getitem__)
+        highest = max(group, key=tys.__getitem__)
+        for i in sorted({group[0], lowest, highest, group[-1]}):
+            run_x.append(txs[i])
+            run_y.append(tys[i])
+        group.clear()
+
+    column = None
+    for i in range(n):
+        if i and breaks[i]:
+            flush_group()
+            runs.append((run_x, run_y))
+            run_x, run_y = [], []
+            column = None
+        c = math.floor(txs[i])
+        if c != column and group:
+            flush_group()
+        column = c
+        group.append(i)
+    flush_group()
+    runs.append((run_x, run_y))
+    return runs
+
+
+class Series:
+    """One plotted curve, with its samples in contiguous float64 buffers.
+
+    Bounds and the hover index are computed once on construction. ``view`` holds the curve
+    resampled for the current viewport, if any, which drawing and hover prefer over the
+    initial grid.
+    """
+
+    __slots__ = ("expr", "compiled", "color_index", "xs", "ys", "bounds", "index", "view", "_polylines")
+
+    def __init__(self, expr, compiled, xs, ys, color_index=0):
+        self.expr = expr
+        self.compiled = compiled
+        self.color_index = color_index
+        self.xs = float_buffer(xs)
+        self.ys = float_buffer(ys)
+        self.bounds = series_bounds(self.xs, self.ys)
+        self.index = PointIndex(self.xs, self.ys)
+        self.view = None
+        self._polylines = {}
+
+    def __len__(self):
+        return len(self.xs)
+
+    @property
+    def visible(self):
+        return self.view if self.view is not None else self
+
+    def resampled(self, xs, ys):
+        """A series for the same expression with new samples, to be installed as ``view``."""
+        return Series(self.expr, self.compiled, xs, ys, self.color_index)
+
+    def samples(self, x_min, x_max, pixels):
+        """The (xs, ys) buffers to draw when ``x_min``..``x_max`` spans ``pixels`` columns."""
+        return self.xs, self.ys
+
+    def polylines(self, view_bounds, width, height, clip=True):
+        """Screen-space runs to stroke for this view, decimated to the pixel grid and cached.
+
+        With ``clip``, only samples inside the view's x range, plus one neighbour on each side,
+        are used; repeat mode turns it off so the same runs can be translated to other tiles.
+        Runs are split where consecutive samples jump by more than a quarter of the view's
+        height, which is how poles like tan(x) avoid being joined by vertical lines.
+        """
+        key = (view_bounds, width, height, clip)
+        cached = self._polylines.get(key)
+        if cached is not None:
+            return cached
+        runs = self._build_polylines(view_bounds, width, height, clip)
+        if len(self._polylines) >= 16:
+            # Views change continuously while panning; only recent ones are worth keeping.
+            self._polylines.clear()
+        self._polylines[key] = runs
+        return runs
+
+    def drop_polylines(self):
+        """Forget the cached runs of this series and its view, e.g. while it is off screen."""
+        self._polylines.clear()
+        if self.view is not None:
+            self.view.drop_polylines()
+
+    def _build_polylines(self, view_bounds, width, height, clip):
+        view_min_x, view_max_x, view_min_y, view_max_y = view_bounds
+        if clip:
+            xs, ys = self.samples(view_min_x, view_max_x, width)
+            lo = max(bisect.bisect_left(xs, view_min_x) - 1, 0)
+            hi = bisect.bisect_right(xs, view_max_x) + 1
+        else:
+            min_x, max_x = self.bounds[0], self.bounds[1]
+            xs, ys = self.samples(min_x, max_x, width * (max_x - min_x) / (view_max_x - view_min_x))
+            lo, hi = 0, len(xs)
+        ys = ys[lo:hi]
+        txs, tys = to_screen(xs[lo:hi], ys, view_bounds, width, height)
+        jump = (view_max_y - view_min_y) / 4
+        if np is not None:
+            breaks = np.r_[False, np.abs(np.diff(ys)) > jump]
+        else:
+            breaks = [False] + [abs(ys[i] - ys[i - 1]) > jump for i in range(1, len(ys))]
+        return decimate_polyline(txs, tys, breaks)
+
+
+def envelope_level(xs, ys, factor=8):
+    """Reduce x-sorted samples to the lowest and highest point of every ``factor`` consecutive ones.
+
+    The kept points are real samples, in their original order.
+    """
+    n = len(xs)
+    if np is not None:
+        buckets = -(-n // factor)
+        # Padding with the last value never moves a bucket's first minimum or maximum.
+        padded = np.pad(ys, (0, buckets * factor - n), mode="edge").reshape(buckets, factor)
+        base = np.arange(buckets) * factor
+        picks = np.sort(np.stack([base + padded.argmin(axis=1), base + padded.argmax(axis=1)], axis=1), axis=1)
+        picks = picks.ravel()
+        picks = picks[np.r_[True, picks[1:] != picks[:-1]]]
+        return xs[picks], ys[picks]
+    out_x, out_y = array("d"), array("d")
+    for start in range(0, n, factor):
+        bucket = range(start, min(start + factor, n))
+        lowest = min(bucket, key=ys.__getitem__)
+        highest = max(bucket, key=ys.__getitem__)
+        for i in sorted({lowest, highest}):
+            out_x.append(xs[i])
+            out_y.append(ys[i])
+    return out_x, out_y
+
+
+class EnvelopePyramid:
+    """Min/max envelopes of a large x-sorted series at successively coarser resolutions.
+
+    Built once when the data is loaded. Every zoom level draws and hovers the coarsest level
+    that still has a few points per pixel column, so the cost of a frame depends on the
+    widget's width rather than on the number of rows, while peaks and dips stay visible.
+    """
+
+    def __init__(self, xs, ys, min_points=4096):
+        self.levels = [(xs, ys)]
+        while len(self.levels[-1][0]) > min_points:
+            self.levels.append(envelope_level(*self.levels[-1]))
+        self.indexes = [PointIndex(level_xs, level_ys) for level_xs, level_ys in self.levels]
+
+    def level_for(self, x_min, x_max, pixels):
+        """Index of the coarsest level with at least four points per pixel between ``x_min`` and ``x_max``."""
+        for level in range(len(self.levels) - 1, 0, -1):
+            xs = self.levels[level][0]
+            if bisect.bisect_right(xs, x_max) - bisect.bisect_left(xs, x_min) >= 4 * pixels:
+                return level
+        return 0
+
+    def nearest(self, x, y, view_bounds, width, height, max_dist):
+        """Like ``PointIndex.nearest``, on the level drawn for ``view_bounds``."""
+        level = self.level_for(view_bounds[0], view_bounds[1], width)
+        return self.indexes[level].nearest(x, y, view_bounds, width, height, max_dist)
+
+
+class DataSeries(Series):
+    """A series of measured (x, y) rows rather than an evaluated expression.
+
+    Rows are kept sorted by x and drawn through an ``EnvelopePyramid``; they are never resampled.
+    """
+
+    __slots__ = ("pyramid",)
+
+    def __init__(self, label, xs, ys, color_index=0):
+        super().__init__(label, None, xs, ys, color_index)
+        # The hover index already holds the rows sorted by x.
+        self.xs, self.ys = self.index.xs, self.index.ys
+        self.pyramid = EnvelopePyramid(self.xs, self.ys)
+        self.index = self.pyramid
+
+    def samples(self, x_min, x_max, pixels):
+        return self.pyramid.levels[self.pyramid.level_for(x_min, x_max, pixels)]
+
+
+class PathSeries(Series):
+    """A curve kept in the order it was traced: parametric, polar or implicit.
+
+    NaN points in the samples mark where the pen lifts; they are dropped on construction and
+    remembered in ``breaks``. Drawing keeps one point per pixel the path enters instead of
+    decimating by column, since the path may run in any direction.
+    """
+
+    __slots__ = ("breaks",)
+
+    def __init__(self, expr, compiled, xs, ys, color_index=0):
+        xs, ys = float_buffer(xs), float_buffer(ys)
+        if np is not None:
+            finite = np.isfinite(xs) & np.isfinite(ys)
+            breaks = np.r_[True, ~finite[:-1]][finite]
+            xs, ys = xs[finite], ys[finite]
+        else:
+            breaks, kept_x, kept_y = [], array("d"), array("d")
+            lifted = True
+            for x, y in zip(xs, ys):
+                if math.isnan(x) or math.isnan(y):
+                    lifted = True
+                    continue
+                breaks.append(lifted)
+                kept_x.append(x)
+                kept_y.append(y)
+                lifted = False
+            xs, ys = kept_x, kept_y
+        super().__init__(expr, compiled, xs, ys, color_index)
+        self.breaks = breaks
+
+    def resampled(self, xs, ys):
+        return PathSeries(self.expr, self.compiled, xs, ys, self.color_index)
+
+    def _build_polylines(self, view_bounds, width, height, clip):
+        # Like function curves, steps of more than a quarter of the view (asymptotes) lift the pen.
+        txs, tys = to_screen(self.xs, self.ys, view_bounds, width, height)
+        if np is not None:
+            txs, tys = np.asarray(txs), np.asarray(tys)
+            breaks = np.array(self.breaks, dtype=bool)
+            breaks[1:] |= (np.abs(np.diff(txs)) > width / 4) | (np.abs(np.diff(tys)) > height / 4)
+            columns, rows = np.floor(txs), np.floor(tys)
+            moved = np.r_[True, (columns[1:] != columns[:-1]) | (rows[1:] != rows[:-1])]
+            keep = breaks | moved | np.r_[breaks[1:], True]
+            kept = np.flatnonzero(keep)
+            return [(txs[run].tolist(), tys[run].tolist())
+                    for run in np.split(kept, np.flatnonzero(breaks[kept])) if len(run) > 1]
+        runs = []
+        run_x, run_y, cell = [], [], None
+        for i, (tx, ty) in enumerate(zip(txs, tys)):
+            if i == 0 or self.breaks[i] or abs(tx - txs[i - 1]) > width / 4 or abs(ty - tys[i - 1]) > height / 4:
+                if len(run_x) > 1:
+                    runs.append((run_x, run_y))
+                run_x, run_y, cell = [], [], None
+            here = (math.floor(tx), math.floor(ty))
+            if here != cell:
+                run_x.append(tx)
+                run_y.append(ty)
+                cell = here
+            elif i + 1 == len(txs) or self.breaks[i + 1]:
+                run_x.append(tx)
+                run_y.append(ty)
+        if len(run_x) > 1:
+            runs.append((run_x, run_y))
+        return runs
+
+
+def repeat_tiles(repeat_mode, tile_bounds, view_bounds, max_tiles=1024):
+    """Offsets (dx, dy) of every repeated copy of ``tile_bounds`` that intersects the view.
+
+    Copies are spaced by the tile's width and/or height depending on ``repeat_mode`` ("off",
+    "horizontal", "vertical" or "both"); (0, 0) is the original. When zoomed out so far that
+    more than ``max_tiles`` copies would be visible, the ones closest to the view center are kept.
+    """
+    min_x, max_x, min_y, max_y = tile_bounds
+    view_min_x, view_max_x, view_min_y, view_max_y = view_bounds
+    dx = max_x - min_x
+    dy = max_y - min_y
+    columns = rows = range(0, 1)
+    if repeat_mode in ("horizontal", "both"):
+        columns = range(math.ceil((view_min_x - max_x) / dx), math.floor((view_max_x - min_x) / dx) + 1)
+    if repeat_mode in ("vertical", "both"):
+        rows = range(math.ceil((view_min_y - max_y) / dy), math.floor((view_max_y - min_y) / dy) + 1)
+    if len(columns) * len(rows) > max_tiles:
+        side = max(int(math.sqrt(max_tiles)), 1)
+        if len(columns) > side:
+            mid = (columns.start + columns.stop) // 2
+            columns = range(mid - side // 2, mid - side // 2 + side)
+        if len(rows) > side:
+            mid = (rows.start + rows.stop) // 2
+            rows = range(mid - side // 2, mid - side // 2 + side)
+    return [(i * dx, j * dy) for i in columns for j in rows]
+
+
+class StageTimer:
+    """Rolling timings of the stages of evaluation, drawing and hover, for the debug overlay.
+
+    ``stage(name)`` times a ``with`` block; ``record`` stores a measurement taken elsewhere,
+    with an optional detail such as a point count, and ``note`` a detail without a time. Each stage keeps its last ``history``
+    samples. When disabled, ``stage`` hands out a shared no-op context manager and callers
+    guard any extra counting with ``enabled``, so instrumentation costs next to nothing.
+    """
+
+    _DISABLED = contextlib.nullcontext()
+    # Every widget's timer logs to the same file; one handle per path serves them all.
+    _log_files = {}
+    _log_lock = threading.Lock()
+
+    def __init__(self, enabled=False, log_path=None, history=120):
+        self.enabled = enabled
+        self.log_path = log_path
+        self.history = history
+        self.samples = {}
+        self.details = {}
+        self.frames = collections.deque(maxlen=history)
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def stage(self, name):
+        if not self.enabled:
+            return self._DISABLED
+        return self._timed(name)
+
+    def record(self, name, seconds, detail=None):
+        if not self.enabled:
+            return
+        if name not in self.samples:
+            self.samples[name] = collections.deque(maxlen=self.history)
+        self.samples[name].append(seconds)
+        if detail is not None:
+            self.details[name] = detail
+        self._write_log(f"{name} {seconds * 1000:.3f}ms {detail or ''}")
+
+    def note(self, name, detail):
+        if not self.enabled:
+            return
+        self.details[name] = detail
+        self._write_log(f"{name} {detail}")
+
+    def _write_log(self, line):
+        if self.log_path:
+            try:
+                with self._log_lock:
+                    log = self._log_files.get(self.log_path)
+                    if log is None:
+                        log = self._log_files[self.log_path] = open(self.log_path, "a", buffering=1,
+                                                                    encoding="utf-8")
+                    log.write(f"{time.time():.3f} {line}\n")
+            except OSError:
+                self.log_path = None
+
+    def frame(self):
+        """Mark the start of a drawn frame, for the frames-per-second figure."""
+        if self.enabled:
+            self.frames.append(time.perf_counter())
+
+    def summary(self) -> List[str]:
+        """One line per stage (mean time and latest detail) plus the recent frame rate."""
+        lines = []
+        for name, samples in self.samples.items():
+            line = f"{name}: {sum(samples) / len(samples) * 1000:.2f} ms"
+            if name in self.details:
+                line += f" ({self.details[name]})"
+            lines.append(line)
+        lines.extend(f"{name}: {detail}" for name, detail in self.details.items() if name not in self.samples)
+        if len(self.frames) > 1 and self.frames[-1] > self.frames[0]:
+            lines.append(f"fps: {(len(self.frames) - 1) / (self.frames[-1] - self.frames[0]):.1f}")
+        return lines
+
+
+class LayerCache:
+    """Offscreen surfaces for the static layers of a plot, repainted only when their key changes."""
+
+    def __init__(self):
+        self.layers = {}
+
+    def get(self, name, key, target, width, height, paint):
+        """Return the surface for layer ``name``, calling ``paint(ctx)`` if ``key`` changed."""
+        cached = self.layers.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        surface = target.create_similar(cairo.Content.COLOR_ALPHA, width, height)
+        paint(cairo.Context(surface))
+        self.layers[name] = (key, surface)
+        return surface
+
+    def compose(self, target, width, height, layers):
+        """Flatten ``layers`` ((name, key, paint) from bottom to top) into one cached surface."""
+        surfaces = [self.get(name, key, target, width, height, paint) for name, key, paint in layers]
+        composite_key = tuple(id(surface) for surface in surfaces)
+        cached = self.layers.get("composite")
+        if cached is not None and cached[0] == composite_key:
+            return cached[1]
+        composite = target.create_similar(cairo.Content.COLOR_ALPHA, width, height)
+        ctx = cairo.Context(composite)
+        for surface in surfaces:
+            ctx.set_source_surface(surface)
+            ctx.paint()
+        # Keep the layer surfaces referenced by the key alive so their ids stay unique.
+        self.layers["composite"] = (composite_key, composite, surfaces)
+        return composite
+
+    def clear(self):
+        self.layers.clear()
+
+
+def snap_point(graphs, x, y, view_bounds, width, height, threshold=10):
+    """Snap pixel (x, y) to the nearest graph point, or the origin, within ``threshold`` pixels.
+
+    Returns (math_x, math_y, pixel_x, pixel_y), or None if nothing is close enough.
+    """
+    view_min_x, view_max_x, view_min_y, view_max_y = view_bounds
+    snap_candidate = None
+    min_dist = threshold
+    for graph in graphs:
+        found = graph.visible.index.nearest(x, y, view_bounds, width, height, min_dist)
+        if found:
+            (pt_x, pt_y), (pix_x, pix_y), min_dist = found
+            snap_candidate = (pt_x, pt_y, pix_x, pix_y)
+    origin_x = (-view_min_x / (view_max_x - view_min_x)) * width
+    origin_y = height - (-view_min_y / (view_max_y - view_min_y)) * height
+    if math.hypot(origin_x - x, origin_y - y) < min_dist:
+        snap_candidate = (0, 0, origin_x, origin_y)
+    return snap_candidate
+
+
+# Grid the feature search runs on, and the most feature points kept per graph.
+FEATURE_SAMPLES = 4001
+MAX_FEATURES = 5000
+# Hover snaps to a feature point within this many pixels in preference to plain samples.
+FEATURE_SNAP_DISTANCE = 12
+
+
+def _sign_changes(values):
+    """Indices i where values[i] and values[i + 1] are both defined and differ in sign."""
+    if np is not None:
+        values = np.asarray(values, dtype=float)
+        positive = values > 0
+        defined = np.isfinite(values)
+        return np.flatnonzero((positive[1:] != positive[:-1]) & defined[1:] & defined[:-1]).tolist()
+    return [i for i in range(len(values) - 1)
+            if not (math.isnan(values[i]) or math.isnan(values[i + 1])) and (values[i] > 0) != (values[i + 1] > 0)]
+
+
+def _owned_evaluator(functions, owners):
+    """A batch function giving ``functions[owners[i]]`` at its i-th point, with one call per function."""
+    groups = {}
+    for i, owner in enumerate(owners):
+        groups.setdefault(owner, []).append(i)
+    if np is not None:
+        groups = {owner: np.asarray(members) for owner, members in groups.items()}
+
+        def evaluate(points):
+            points = np.asarray(points, dtype=float)
+            values = np.full(len(points), np.nan)
+            for owner, members in groups.items():
+                values[members] = functions[owner](points[members])
+            return values
+    else:
+        def evaluate(points):
+            values = [math.nan] * len(points)
+            for owner, members in groups.items():
+                for i, value in zip(members, functions[owner]([points[i] for i in members])):
+                    values[i] = value
+            return values
+    return evaluate
+
+
+def _refine_roots(evaluate, brackets, iterations=44, continuous=False):
+    """Bisect every (low, high, bound) bracket around a sign change of ``evaluate`` at once.
+
+    Each step is one batch evaluation. Returns the indices of the brackets that hold a root
+    and the roots; a bracket whose final value exceeds ``bound`` (the larger magnitude at its
+    ends) straddled a pole rather than a root. With ``continuous``, brackets whose ends still
+    differ by about as much as they started straddled a jump and are dropped too.
+    """
+    if not brackets:
+        return [], []
+    lows = [low for low, _, _ in brackets]
+    highs = [high for _, high, _ in brackets]
+    if np is not None:
+        lows, highs = np.asarray(lows), np.asarray(highs)
+        f_lows = np.asarray(evaluate(lows))
+        for _ in range(iterations):
+            mids = (lows + highs) / 2
+            f_mids = np.asarray(evaluate(mids))
+            left = (f_lows > 0) != (f_mids > 0)
+            highs = np.where(left, mids, highs)
+            lows = np.where(left, lows, mids)
+            f_lows = np.where(left, f_lows, f_mids)
+        roots = ((lows + highs) / 2).tolist()
+    else:
+        f_lows = list(evaluate(lows))
+        for _ in range(iterations):
+            mids = [(low + high) / 2 for low, high in zip(lows, highs)]
+            for i, f_mid in enumerate(evaluate(mids)):
+                if (f_lows[i] > 0) != (f_mid > 0):
+                    highs[i] = mids[i]
+                else:
+                    lows[i], f_lows[i] = mids[i], f_mid
+        roots = [(low + high) / 2 for low, high in zip(lows, highs)]
+    kept = [i for i, value in enumerate(evaluate(roots)) if abs(value) <= brackets[i][2]]
+    if continuous:
+        ends = [max(abs(a), abs(b)) for a, b in zip(evaluate(lows), evaluate(highs))]
+        kept = [i for i in kept if ends[i] <= 1e-3 * brackets[i][2]]
+    return kept, [roots[i] for i in kept]
+
+
+def _brackets(xs, values):
+    """(low, high, bound) around every sign change of ``values`` sampled at ``xs``."""
+    return [(xs[i], xs[i + 1], max(abs(values[i]), abs(values[i + 1]))) for i in _sign_changes(values)]
+
+
+def find_features(curves, x_min, x_max, samples=FEATURE_SAMPLES):
+    """Roots, local extrema and pairwise intersections of function curves over [x_min, x_max].
+
+    ``curves`` is a list of (CompiledExpression, params). Sign changes of the curves, of their
+    slopes and of their pairwise differences are found on an even grid, then all brackets of a
+    kind are refined by bisection together, evaluating each curve once per step. Returns
+    (x, y, kind) triples sorted by x, kind being "Root", "Maximum", "Minimum" or "Intersection".
+    """
+    step = (x_max - x_min) / (samples - 1)
+    h = step / 64
+    xs = [x_min + i * step for i in range(samples)]
+    functions = [functools.partial(compiled.evaluate_aligned, params=params) for compiled, params in curves]
+    grids = [list(fn(xs)) for fn in functions]
+    features = []
+
+    brackets, owners = [], []
+    for k, ys in enumerate(grids):
+        found = _brackets(xs, ys)
+        brackets += found
+        owners += [k] * len(found)
+    # A curve that steps over zero (x//1) has no root there, just a jump.
+    _, roots = _refine_roots(_owned_evaluator(functions, owners), brackets, continuous=True)
+    features += [(x, 0.0, "Root") for x in roots]
+
+    # Extrema are roots of the slope, taken as a central difference.
+    brackets, owners = [], []
+    for k, fn in enumerate(functions):
+        slopes = [b - a for a, b in zip(fn([x - h for x in xs]), fn([x + h for x in xs]))]
+        found = _brackets(xs, slopes)
+        brackets += found
+        owners += [k] * len(found)
+    values = _owned_evaluator(functions, owners)
+
+    def slope(points):
+        return [b - a for a, b in zip(values([x - h for x in points]), values([x + h for x in points]))]
+
+    # Across a step (x//1) the slope jumps from zero to the step height and back without
+    # ever passing through zero in between.
+    kept, extrema = _refine_roots(slope, brackets, continuous=True)
+    owners = [owners[i] for i in kept]
+    values = _owned_evaluator(functions, owners)
+    peaks = zip(extrema, values(extrema), values([x - step / 4 for x in extrema]),
+                values([x + step / 4 for x in extrema]))
+    for x, y, below, above in peaks:
+        # A slope that flips sign across a pole isn't an extremum, and neither is the edge of a
+        # plateau (x if x > 0 else 0); the neighbours give both away.
+        if y > below and y > above:
+            features.append((x, float(y), "Maximum"))
+        elif y < below and y < above:
+            features.append((x, float(y), "Minimum"))
+
+    brackets, firsts, seconds = [], [], []
+    for i in range(len(grids)):
+        for j in range(i + 1, len(grids)):
+            found = _brackets(xs, [a - b for a, b in zip(grids[i], grids[j])])
+            brackets += found
+            firsts += [i] * len(found)
+            seconds += [j] * len(found)
+    first, second = _owned_evaluator(functions, firsts), _owned_evaluator(functions, seconds)
+    kept, crossings = _refine_roots(lambda points: [a - b for a, b in zip(first(points), second(points))], brackets,
+                                    continuous=True)
+    first = _owned_evaluator(functions, [firsts[i] for i in kept])
+    features += [(x, float(y), "Intersection") for x, y in zip(crossings, first(crossings))]
+
+    # Neighbouring brackets (e.g. around a root right on a grid point) can find a point twice.
+    features.sort(key=lambda feature: (feature[2], feature[0], feature[1]))
+    unique = []
+    for x, y, kind in features:
+        if math.isnan(y):
+            continue
+        if unique and unique[-1][2] == kind and x - unique[-1][0] <= step / 1000 \
+                and abs(y - unique[-1][1]) <= 1e-6 * (1 + abs(y)):
+            continue
+        unique.append((x, y, kind))
+    unique.sort()
+    # Past the cap, thin evenly over the whole domain, keeping roots and extrema before the
+    # intersections, which grow with the square of the number of curves.
+    kept = []
+    for kinds in (("Root", "Maximum", "Minimum"), ("Intersection",)):
+        group = [feature for feature in unique if feature[2] in kinds]
+        budget = MAX_FEATURES - len(kept)
+        if len(group) > budget:
+            group = [group[i * len(group) // budget] for i in range(budget)]
+        kept += group
+    kept.sort()
+    return kept
+
+
+def features_task(curves, x_min, x_max):
+    """Pool task: ``find_features`` for (source, params) pairs as passed to ``evaluate_task``."""
+    return find_features([(compile_expression(source, tuple(name for name, _ in params)), params)
+                          for source, params in curves], x_min, x_max)
+
+
+class FeatureIndex:
+    """Feature points of a graph (see ``find_features``), queried by hover like a ``PointIndex``."""
+
+    def __init__(self, features):
+        self.kinds = {}
+        for x, y, kind in features:
+            self.kinds.setdefault((x, y), kind)
+        self.index = PointIndex(float_buffer([x for x, _, _ in features]), float_buffer([y for _, y, _ in features]))
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def nearest(self, x, y, view_bounds, width, height, max_dist):
+        """Return (math_x, math_y, pixel_x, pixel_y, kind) of the closest feature, or None."""
+        found = self.index.nearest(x, y, view_bounds, width, height, max_dist)
+        if found is None:
+            return None
+        (pt_x, pt_y), (pix_x, pix_y), _ = found
+        return pt_x, pt_y, pix_x, pix_y, self.kinds[(pt_x, pt_y)]
+
+
+DATA_LINE = re.compile(r"data\s*:\s*(.*)$")
+DATA_SEPARATOR = re.compile(r"[,;\s]+")
+# Column names such as ``x, y`` or ``"time";"value"``, allowed as the first line of inline rows.
+DATA_HEADER = re.compile(r'"?[A-Za-z_][\w ]*"?(\s*[,;\t]\s*"?[A-Za-z_][\w ]*"?)+')
+
+
+def parse_data_row(line):
+    """The (x, y) of a ``x, y`` (or whitespace or semicolon separated) row, or None."""
+    fields = DATA_SEPARATOR.split(line.strip())
+    if len(fields) < 2:
+        return None
+    try:
+        x, y = float(fields[0]), float(fields[1])
+    except ValueError:
+        return None
+    if not (math.isfinite(x) and math.isfinite(y)):
+        return None
+    return x, y
+
+
+def parse_data_rows(lines):
+    """Stream rows into float buffers, skipping headers, comments and malformed lines."""
+    xs, ys = array("d"), array("d")
+    for line in lines:
+        row = parse_data_row(line)
+        if row is not None:
+            xs.append(row[0])
+            ys.append(row[1])
+    return xs, ys
+
+
+def load_data_file(path):
+    """Read (xs, ys) from a CSV/whitespace text file, or a raw float64 file (.f64, .bin).
+
+    A raw file holds every x value followed by every y value, so with NumPy both columns are
+    contiguous views of one memory map and are never copied into RAM; text files are parsed
+    line by line without reading them whole.
+    """
+    path = os.path.expanduser(path)
+    # Paths come from model output: devices and FIFOs like /dev/zero would be read forever.
+    if not os.path.isfile(path):
+        raise ValueError(f"not a regular file: {path}")
+    if path.endswith((".f64", ".bin")):
+        if np is not None:
+            columns = np.memmap(path, dtype="<f8", mode="r")
+            count = len(columns) // 2
+            return columns[:count], columns[count:2 * count]
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            values = array("d")
+            values.frombytes(mapped[:len(mapped) // 16 * 16])
+        if sys.byteorder != "little":
+            values.byteswap()
+        count = len(values) // 2
+        return values[:count], values[count:]
+    with open(path, encoding="utf-8", errors="replace") as f:
+        if np is not None:
+            # Sniff the separator and header from the first lines, then let NumPy's C parser
+            # stream the rest; anything irregular goes through the forgiving parser instead.
+            head = [line for _, line in zip(range(2), f)]
+            delimiter = next((sep for sep in (",", ";") if sep in head[-1]), None) if head else None
+            skip = sum(1 for line in head[:1] if parse_data_row(line) is None)
+            f.seek(0)
+            try:
+                rows = np.loadtxt(f, delimiter=delimiter, skiprows=skip, usecols=(0, 1), ndmin=2)
+            except ValueError:
+                f.seek(0)
+            else:
+                finite = np.isfinite(rows).all(axis=1)
+                return rows[finite, 0], rows[finite, 1]
+        return parse_data_rows(f)
+
+
+def data_task(source, inline, color_index):
+    """Pool task: load a data block (a file path, or the rows themselves) into a ``DataSeries``."""
+    if inline:
+        xs, ys = parse_data_rows(source.splitlines())
+        label = "data"
+    else:
+        xs, ys = load_data_file(source)
+        label = os.path.basename(source)
+    return DataSeries(label, xs, ys, color_index)
+
+
+PARAM_LINE = re.compile(r"param\s+([A-Za-z_]\w*)\s*(?:=\s*(.+?)\s+)?in\s*\[(.+),(.+)\]$")
+# Any line declaring a parameter, well-formed or not.
+PARAM_START = re.compile(r"param\s")
+# Variables of curves and shapes; a parameter of the same name would be shadowed by them.
+RESERVED_NAMES = ("x", "y", "t", "theta")
+
+
+def parse_param(line):
+    """The (name, value, minimum, maximum) of a ``param a = 1 in [0, 5]`` line, or None.
+
+    Values may be constant expressions such as ``2*pi``; the value defaults to the minimum.
+    """
+    match = PARAM_LINE.match(line.strip())
+    if match is None or match.group(1) in SCALAR_NAMESPACE or match.group(1) in RESERVED_NAMES:
+        return None
+    name, value, low, high = match.groups()
+    low, high = (compile_expression(bound.strip()).evaluate_aligned([0.0])[0] for bound in (low, high))
+    value = compile_expression(value).evaluate_aligned([0.0])[0] if value else low
+    if math.isnan(low) or math.isnan(high) or math.isnan(value) or not low < high:
+        return None
+    return name, float(min(max(value, low), high)), float(low), float(high)
+
+
+def codeblock_parameters(codeblock: str) -> dict:
+    """The parameters declared in a ``graph`` codeblock, as {name: (value, minimum, maximum)}."""
+    params = {}
+    for line in codeblock.splitlines():
+        param = parse_param(line)
+        if param is not None:
+            params[param[0]] = param[1:]
+    return params
+
+
+def invalid_parameters(codeblock: str) -> List[str]:
+    """The ``param`` lines of a codeblock that don't declare a usable parameter."""
+    return [line.strip() for line in codeblock.splitlines()
+            if PARAM_START.match(line.strip()) and parse_param(line) is None]
+
+
+def codeblock_entries(codeblock: str):
+    """The plots of a ``graph`` codeblock in order, as (kind, source) pairs.
+
+    Each non-empty line is an expression (kind "expr"), except ``data: <path>`` lines, which
+    plot a file (kind "file"), and a bare ``data:`` line, which plots the ``x, y`` rows that
+    follow it, after an optional header line (kind "inline"). Implicit equations, ``(x(t), y(t))``
+    pairs and ``r = f(theta)`` lines have the kinds of their ``ShapeExpression``, except
+    ``y = f(x)``, which is the expression ``f(x)``. Parameter declarations, valid or not, are
+    left out; see ``codeblock_parameters`` and ``invalid_parameters``.
+    """
+    entries = []
+    rows = None
+    for line in codeblock.strip().splitlines():
+        line = line.strip()
+        if rows is not None:
+            if parse_data_row(line) is not None or (not rows and DATA_HEADER.fullmatch(line)):
+                rows.append(line)
+                continue
+            entries.append(("inline", "\n".join(rows)))
+            rows = None
+        if not line:
+            continue
+        match = DATA_LINE.match(line)
+        if PARAM_START.match(line):
+            continue
+        shape = compile_shape(line) if match is None else None
+        if shape is not None and shape.explicit is not None:
+            entries.append(("expr", shape.explicit))
+        elif shape is not None and shape.kind is not None:
+            entries.append((shape.kind, line))
+        elif match is None:
+            entries.append(("expr", line))
+        elif match.group(1):
+            entries.append(("file", match.group(1)))
+        else:
+            rows = []
+    if rows is not None:
+        entries.append(("inline", "\n".join(rows)))
+    return entries
+
+
+def codeblock_expressions(codeblock: str) -> List[str]:
+    """The expressions of a ``graph`` codeblock, one per non-empty line outside data blocks."""
+    return [source for kind, source in codeblock_entries(codeblock) if kind == "expr"]
+
+
+def default_x_values():
+    """The x grid every graph is first evaluated on."""
+    return [i / 20 for i in range(-200, 201)]
+
+
+def evaluate_codeblock(codeblock: str, x_values=None, width=400, height=400, errors=None) -> List[Series]:
+    """Evaluate every line of a codeblock synchronously, as the render command line does.
+
+    Implicit curves are traced over the square spanned by ``x_values`` at ``width`` x ``height``.
+    If ``errors`` is a list, lines that fail (and invalid ``param`` lines) are left out and a
+    message for each is appended to it, as the widget does; otherwise the first failure raises.
+    """
+    x_values = default_x_values() if x_values is None else x_values
+    params = {name: value for name, (value, _, _) in codeblock_parameters(codeblock).items()}
+    if errors is not None:
+        errors.extend(f"invalid parameter declaration: {line}" for line in invalid_parameters(codeblock))
+    graphs = []
+    for idx, (kind, expr) in enumerate(codeblock_entries(codeblock)):
+        try:
+            if kind in ("file", "inline"):
+                graphs.append(data_task(expr, kind == "inline", idx))
+                continue
+            if kind != "expr":
+                shape = compile_shape(expr, tuple(params))
+                bounds = (x_values[0], x_values[-1], x_values[0], x_values[-1])
+                graphs.append(PathSeries(expr, shape, *shape.trace(bounds, width, height, params), color_index=idx))
+                continue
+            compiled = compile_expression(expr, tuple(params))
+            xs, ys = compiled.evaluate(x_values, params)
+            graphs.append(Series(expr, compiled, xs, ys, color_index=idx))
+        except Exception as e:
+            if errors is None:
+                raise
+            # File errors already name the path.
+            errors.append(str(e) if kind == "file" else f"{expr.splitlines()[0] if expr else kind}: {e}")
+    return graphs
+
+
+THEMES = {
+    "light": {
+        "grid": (0.9, 0.9, 0.9, 1),
+        "axes": (0, 0, 0, 1),
+        "text": (0.2, 0.2, 0.2, 1),
+        "palette": [
+            (0.2, 0.6, 1.0, 1),
+            (1.0, 0.4, 0.4, 1),
+            (0.4, 1.0, 0.4, 1),
+            (0.8, 0.2, 1.0, 1)
+        ],
+    },
+    "dark": {
+        "grid": (0.4, 0.4, 0.4, 1),
+        "axes": (1, 1, 1, 1),
+        "text": (1, 1, 1, 1),
+        "palette": [
+            (0.4, 0.8, 1.0, 1),
+            (1.0, 0.6, 0.6, 1),
+            (0.6, 1.0, 0.6, 1),
+            (1.0, 0.8, 1.0, 1)
+        ],
+    },
+}
+
+
+class GraphRenderer:
+    """Draws graphs onto any cairo context: the widget's, an ImageSurface, SVGSurface or PDFSurface.
+
+    The GTK widget and the ``render`` command line share this code path. With ``cached`` the
+    static layers go through a ``LayerCache`` so repeated frames only blit them.
+    """
+
+    def __init__(self, tick_count=7, show_axes=True, grid_density=20, show_bounding_box=False, repeat_mode="off",
+                 timer=None):
+        self.tick_count = tick_count
+        self.show_axes = show_axes
+        self.grid_density = grid_density
+        self.show_bounding_box = show_bounding_box
+        self.repeat_mode = repeat_mode
+        self.timer = timer or StageTimer()
+        self.layers = LayerCache()
+        # (view_bounds, width, height) the cached composite was drawn for, used by ``preview``.
+        self.composite_view = None
+
+    def render(self, ctx, width, height, graphs, graph_bounds=None, view_bounds=None, dark_theme=False,
+               hover_pixel=None, data_revision=0, cached=True, overlay_lines=None):
+        """Draw a frame; ``graphs`` None means results are still loading.
+
+        ``overlay_lines`` are drawn in a box in the top right corner (the debug overlay).
+        """
+        timer = self.timer
+        tick_count = self.tick_count
+        show_axes = self.show_axes
+        grid_density = self.grid_density
+        show_bounding_box = self.show_bounding_box
+        repeat_mode = self.repeat_mode
+        theme = THEMES["dark" if dark_theme else "light"]
+        grid_color = theme["grid"]
+        axes_color = theme["axes"]
+        text_color = theme["text"]
+        palette = theme["palette"]
+
+        ctx.set_operator(cairo.Operator.SOURCE)
+        ctx.set_source_rgba(0, 0, 0, 0)
+        ctx.paint()
+        ctx.set_operator(cairo.Operator.OVER)
+
+        def paint_grid(ctx):
+            with timer.stage("grid"):
+                _paint_grid(ctx)
+
+        def _paint_grid(ctx):
+            # Draw grid using grid_density setting.
+            ctx.set_source_rgba(*grid_color)
+            ctx.set_line_width(0.5)
+            for i in range(0, width, grid_density):
+                ctx.move_to(i, 0)
+                ctx.line_to(i, height)
+            for i in range(0, height, grid_density):
+                ctx.move_to(0, i)
+                ctx.line_to(width, i)
+            ctx.stroke()
+
+        target = ctx.get_target()
+        grid_key = (width, height, dark_theme)
+
+        if graphs is None:
+            if cached:
+                ctx.set_source_surface(self.layers.get("grid", grid_key, target, width, height, paint_grid))
+                ctx.paint()
+            else:
+                paint_grid(ctx)
+            ctx.set_source_rgba(*text_color)
+            ctx.select_font_face("Sans", cairo.FontSlant.NORMAL, cairo.FontWeight.NORMAL)
+            ctx.set_font_size(20)
+            message = "Loading..."
+            extents = ctx.text_extents(message)
+            ctx.move_to((width - extents.width) / 2, (height + extents.height) / 2)
+            ctx.show_text(message)
+            self.composite_view = None
+            return
+
+        global_min_x, global_max_x, global_min_y, global_max_y = graph_bounds
+        view_min_x, view_max_x, view_min_y, view_max_y = view_bounds
+
+        def transform(x, y):
+            tx = ((x - view_min_x) / (view_max_x - view_min_x)) * width
+            ty = height - ((y - view_min_y) / (view_max_y - view_min_y)) * height
+            return tx, ty
+
+        def paint_axes(ctx):
+            with timer.stage("axes"):
+                _paint_axes(ctx)
+
+        def _paint_axes(ctx):
+            ctx.set_source_rgba(*axes_color)
+            ctx.set_line_width(2)
+            if show_axes or (view_min_y <= 0 <= view_max_y):
+                x_axis_start = transform(view_min_x, 0)
+                x_axis_end = transform(view_max_x, 0)
+                ctx.move_to(*x_axis_start)
+                ctx.line_to(*x_axis_end)
+                ctx.stroke()
+            if show_axes or (view_min_x <= 0 <= view_max_x):
+                y_axis_start = transform(0, view_min_y)
+                y_axis_end = transform(0, view_max_y)
+                ctx.move_to(*y_axis_start)
+                ctx.line_to(*y_axis_end)
+                ctx.stroke()
+
+        def paint_curves(ctx):
+            with timer.stage("curves"):
+                _paint_curves(ctx)
+
+        def _paint_curves(ctx):
+            segments = 0
+            x_scale = width / (view_max_x - view_min_x)
+            y_scale = height / (view_max_y - view_min_y)
+            # Without repeat mode there is a single tile at offset (0, 0).
+            tiles = repeat_tiles(repeat_mode, graph_bounds, view_bounds)
+
+            # Draw graphs with optional repeat mode.
+            for graph in graphs:
+                series = graph.visible
+                if series.bounds is None:
+                    continue
+                min_x, max_x, min_y, max_y = series.bounds
+                # Every segment lies within the curve's bounds, so if they miss the view so does the curve.
+                visible_tiles = [(offset_x, offset_y) for offset_x, offset_y in tiles
+                                 if not (max_x + offset_x < view_min_x or min_x + offset_x > view_max_x
+                                         or max_y + offset_y < view_min_y or min_y + offset_y > view_max_y)]
+                if not visible_tiles:
+                    continue
+                color = palette[graph.color_index % len(palette)]
+                ctx.set_source_rgba(*color)
+                ctx.set_line_width(3)
+                # The path is built once, unclipped when it will be tiled, and replayed
+                # under a translation for every visible copy.
+                runs = series.polylines(view_bounds, width, height, clip=repeat_mode == "off")
+                if timer.enabled:
+                    segments += sum(len(txs) - 1 for txs, _ in runs) * len(visible_tiles)
+                for txs, tys in runs:
+                    ctx.move_to(txs[0], tys[0])
+                    for i in range(1, len(txs)):
+                        ctx.line_to(txs[i], tys[i])
+                if visible_tiles != [(0, 0)]:
+                    path = ctx.copy_path()
+                    ctx.new_path()
+                    for offset_x, offset_y in visible_tiles:
+                        ctx.save()
+                        ctx.translate(offset_x * x_scale, -offset_y * y_scale)
+                        ctx.append_path(path)
+                        ctx.restore()
+                ctx.stroke()
+
+            # Optionally, draw the bounding box for global bounds.
+            if show_bounding_box:
+                ctx.set_source_rgba(*axes_color)
+                ctx.set_line_width(1)
+                ctx.set_dash([4.0, 4.0])
+                top_left = transform(global_min_x, global_max_y)
+                bottom_right = transform(global_max_x, global_min_y)
+                ctx.rectangle(top_left[0], top_left[1],
+                              bottom_right[0] - top_left[0],
+                              bottom_right[1] - top_left[1])
+                ctx.stroke()
+                ctx.set_dash([])
+            if timer.enabled:
+                timer.details["curves"] = f"{segments} segments"
+
+        def paint_labels(ctx):
+            with timer.stage("labels"):
+                _paint_labels(ctx)
+
+        def _paint_labels(ctx):
+            # Draw tick labels.
+            ctx.set_source_rgba(*text_color)
+            ctx.select_font_face("Sans", cairo.FontSlant.NORMAL, cairo.FontWeight.NORMAL)
+            ctx.set_font_size(12)
+            for i in range(tick_count):
+                val = view_min_x + i * ((view_max_x - view_min_x) / (tick_count - 1))
+                tx = (i / (tick_count - 1)) * width
+                ctx.move_to(tx, height - 5)
+                ctx.line_to(tx, height)
+                ctx.stroke()
+                label = f"{val:.2f}"
+                extents = ctx.text_extents(label)
+                ctx.move_to(tx - extents.width / 2, height - 7)
+                ctx.show_text(label)
+            for i in range(tick_count):
+                val = view_min_y + i * ((view_max_y - view_min_y) / (tick_count - 1))
+                ty = height - (i / (tick_count - 1)) * height
+                ctx.move_to(0, ty)
+                ctx.line_to(5, ty)
+                ctx.stroke()
+                label = f"{val:.2f}"
+                extents = ctx.text_extents(label)
+                ctx.move_to(7, ty + extents.height / 2)
+                ctx.show_text(label)
+
+        layers = [
+            ("grid", grid_key, paint_grid),
+            ("axes", grid_key + (view_bounds,), paint_axes),
+            ("curves", grid_key + (view_bounds, graph_bounds, data_revision), paint_curves),
+            ("labels", grid_key + (view_bounds,), paint_labels),
+        ]
+        if cached:
+            # Static layers are cached offscreen and only repainted when their inputs change,
+            # so hover frames just blit the composite and draw the marker on top.
+            ctx.set_source_surface(self.layers.compose(target, width, height, layers))
+            ctx.paint()
+            self.composite_view = (view_bounds, width, height)
+        else:
+            for _, _, paint in layers:
+                paint(ctx)
+
+        # Draw magnetic hover point.
+        if hover_pixel:
+            pix_x, pix_y = hover_pixel
+            ctx.set_source_rgba(*text_color)
+            ctx.arc(pix_x, pix_y, 6, 0, 2 * math.pi)
+            ctx.fill()
+
+        if overlay_lines:
+            self.paint_overlay(ctx, width, overlay_lines)
+
+    def release(self):
+        """Free the cached layer surfaces; the next frame paints them again."""
+        self.layers.clear()
+        self.composite_view = None
+
+    def preview(self, ctx, width, height, view_bounds, overlay_lines=None):
+        """Draw the last composite stretched and shifted onto ``view_bounds``, for frames during a gesture.
+
+        Nothing is repainted, so this costs one blit however heavy the plot. Returns False, drawing
+        nothing, if there is no composite of this size to reuse.
+        """
+        cached = self.layers.layers.get("composite")
+        if cached is None or self.composite_view is None or self.composite_view[1:] != (width, height):
+            return False
+        with self.timer.stage("preview"):
+            old_min_x, old_max_x, old_min_y, old_max_y = self.composite_view[0]
+            min_x, max_x, min_y, max_y = view_bounds
+            scale_x = (old_max_x - old_min_x) / (max_x - min_x)
+            scale_y = (old_max_y - old_min_y) / (max_y - min_y)
+            ctx.set_operator(cairo.Operator.SOURCE)
+            ctx.set_source_rgba(0, 0, 0, 0)
+            ctx.paint()
+            ctx.set_operator(cairo.Operator.OVER)
+            ctx.save()
+            # Map old pixels to new ones: x grows with x, y grows downwards from the top edge.
+            ctx.translate((old_min_x - min_x) / (max_x - min_x) * width,
+                          (max_y - old_max_y) / (max_y - min_y) * height)
+            ctx.scale(scale_x, scale_y)
+            ctx.set_source_surface(cached[1])
+            ctx.get_source().set_filter(cairo.Filter.FAST)
+            ctx.paint()
+            ctx.restore()
+        if overlay_lines:
+            self.paint_overlay(ctx, width, overlay_lines)
+        return True
+
+    @staticmethod
+    def paint_overlay(ctx, width, overlay_lines):
+        """Draw ``overlay_lines`` in a box in the top right corner (the debug overlay)."""
+        ctx.select_font_face("Monospace", cairo.FontSlant.NORMAL, cairo.FontWeight.NORMAL)
+        ctx.set_font_size(10)
+        line_height = 12
+        box_width = max(ctx.text_extents(line).x_advance for line in overlay_lines) + 8
+        box_x = width - box_width - 4
+        ctx.set_source_rgba(0, 0, 0, 0.6)
+        ctx.rectangle(box_x, 4, box_width, line_height * len(overlay_lines) + 6)
+        ctx.fill()
+        ctx.set_source_rgba(1, 1, 1, 1)
+        for i, line in enumerate(overlay_lines):
+            ctx.move_to(box_x + 4, 4 + line_height * (i + 1))
+            ctx.show_text(line)
 
 
 class GraphGeneratorExtension(NewelleExtension):
@@ -33,6 +2050,45 @@ class GraphGeneratorExtension(NewelleExtension):
         self.fixed_range = (self.get_setting("fixed_range") or "false").lower() == "true"
         # repeat_mode: "off", "horizontal", "vertical", "both"
         self.repeat_mode = self.get_setting("repeat_mode") or "off"
+        self.adaptive_sampling = (self.get_setting("adaptive_sampling") or "true").lower() == "true"
+        try:
+            self.sample_budget = int(self.get_setting("sample_budget") or 2000)
+        except Exception:
+            self.sample_budget = 2000
+        # Threads by default: forking a running GTK application is unsafe, and small tasks would
+        # spend more time pickling than evaluating.
+        self.evaluation_workers = self.get_setting("evaluation_workers") or "threads"
+        # Shared by every graph widget; workers are only started once something is evaluated.
+        self.pool = EvaluationPool(processes=self.evaluation_workers == "processes")
+        try:
+            self.cache_size_mb = float(self.get_setting("cache_size_mb") or 64)
+        except Exception:
+            self.cache_size_mb = 64
+        self.disk_cache = (self.get_setting("disk_cache") or "false").lower() == "true"
+        self.debug_overlay = (self.get_setting("debug_overlay") or "false").lower() == "true"
+        self.debug_log = self.get_setting("debug_log") or ""
+        self.result_cache = ResultCache(
+            int(self.cache_size_mb * 1024 * 1024),
+            os.path.join(GLib.get_user_cache_dir(), "newelle-graph") if self.disk_cache else None,
+        )
+        # Widgets register a callback here to drop their data when the system runs low on memory.
+        self.release_callbacks = set()
+        self.memory_monitor = None
+
+    def watch_memory(self):
+        if self.memory_monitor is not None or Gio is None:
+            return
+        try:
+            self.memory_monitor = Gio.MemoryMonitor.dup_default()
+        except Exception:
+            return
+        self.memory_monitor.connect("low-memory-warning", self.on_low_memory)
+
+    def on_low_memory(self, monitor, level):
+        # Everything released here is recomputed (or re-read from the disk cache) on demand.
+        self.result_cache.clear()
+        for release in list(self.release_callbacks):
+            release()
 
     # No install method is provided for this extension
 
@@ -100,6 +2156,60 @@ class GraphGeneratorExtension(NewelleExtension):
                 "type": "combo",
                 "values": [("off", "Off"), ("horizontal", "Horizontal"), ("vertical", "Vertical"), ("both", "Both")],
                 "default": "off"
+            },
+            {
+                "key": "adaptive_sampling",
+                "title": "Adaptive Resampling",
+                "description": "Re-evaluate the visible range after zooming or panning, adding samples where curves bend",
+                "type": "combo",
+                "values": [("true", "True"), ("false", "False")],
+                "default": "true"
+            },
+            {
+                "key": "sample_budget",
+                "title": "Sample Budget",
+                "description": "Maximum number of points per curve when resampling the visible range (e.g., 2000)",
+                "type": "entry",
+                "default": "2000"
+            },
+            {
+                "key": "evaluation_workers",
+                "title": "Evaluation Workers",
+                "description": "Evaluate expressions in threads, or in forked processes (uses all cores, "
+                               "but forking a running application can be unreliable)",
+                "type": "combo",
+                "values": [("threads", "Threads"), ("processes", "Processes")],
+                "default": "threads"
+            },
+            {
+                "key": "cache_size_mb",
+                "title": "Result Cache Size (MB)",
+                "description": "Memory used to keep evaluated curves for reuse across graphs (e.g., 64)",
+                "type": "entry",
+                "default": "64"
+            },
+            {
+                "key": "disk_cache",
+                "title": "Disk Cache",
+                "description": "Also keep evaluated curves on disk so they survive restarts",
+                "type": "combo",
+                "values": [("true", "True"), ("false", "False")],
+                "default": "false"
+            },
+            {
+                "key": "debug_overlay",
+                "title": "Performance Overlay",
+                "description": "Show per-stage timings (evaluation, drawing, hover) and frame rate on each graph",
+                "type": "combo",
+                "values": [("true", "True"), ("false", "False")],
+                "default": "false"
+            },
+            {
+                "key": "debug_log",
+                "title": "Performance Log File",
+                "description": "If set, append every stage timing to this file",
+                "type": "entry",
+                "default": ""
             }
         ]
 
@@ -113,7 +2223,7 @@ class GraphGeneratorExtension(NewelleExtension):
                     "Generate interactive graphs from mathematical functions with a transparent background "
                     "that adapts to light or dark themes. Multiple functions (separated by newlines) will be overlaid "
                     "on a single coordinate system using different colors. Hover over the graph to see a magnetized point "
-                    "that snaps to nearby graph points or the origin. Use the zoom and pan buttons above to navigate.\n"
+                    "that snaps to roots, extrema and intersections, nearby graph points or the origin. Scroll to zoom around the cursor, drag or pinch to navigate, or use the zoom and pan buttons above.\n"
                     "Important settings control tick label count, grid density, fixed display range, and repeat mode."
                 ),
                 "editable": True,
@@ -122,7 +2232,14 @@ class GraphGeneratorExtension(NewelleExtension):
                 "text": (
                     "To generate a graph, use the syntax:\n```graph\n<function_str>\n```\n"
                     "Enter one or more valid Python mathematical expressions (e.g., 'sin(x)', 'x**2', or 'log(x+1)').\n"
-                    "Separate multiple functions with a newline."
+                    "Separate multiple functions with a newline.\n"
+                    "To plot measured data, add a line 'data: <path to a CSV file>', or a line 'data:' followed by "
+                    "one 'x, y' row per line.\n"
+                    "Declare adjustable parameters with lines like 'param a = 1 in [0, 5]' and use them in "
+                    "expressions (e.g., 'a*sin(x)'); each becomes a slider above the graph.\n"
+                    "Besides y = f(x) expressions, lines may be implicit equations in x and y (e.g., 'x**2 + y**2 = 4'), "
+                    "parametric curves '(x(t), y(t))' or polar curves 'r = f(theta)'; the last two may end with "
+                    "'for t in [a, b]' (default [0, 2*pi])."
                 )
             }
         ]
@@ -137,6 +2254,21 @@ class GraphGeneratorExtension(NewelleExtension):
         show_bounding_box = self.show_bounding_box
         fixed_range = self.fixed_range
         repeat_mode = self.repeat_mode
+        adaptive_sampling = self.adaptive_sampling
+        sample_budget = self.sample_budget
+        pool = self.pool
+        result_cache = self.result_cache
+        release_callbacks = self.release_callbacks
+        self.watch_memory()
+        debug_overlay = self.debug_overlay
+        timer = StageTimer(debug_overlay or bool(self.debug_log), self.debug_log or None)
+        renderer = GraphRenderer(tick_count, show_axes, grid_density, show_bounding_box, repeat_mode, timer)
+        x_values = default_x_values()
+        x_buffer = float_buffer(x_values)
+        declared = codeblock_parameters(codeblock)
+        # Current slider values; expressions are compiled knowing every declared name.
+        params = {name: value for name, (value, _, _) in declared.items()}
+        param_names = tuple(params)
 
         outer_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
 
@@ -154,19 +2286,55 @@ class GraphGeneratorExtension(NewelleExtension):
         ctrl_box.append(pan_right_btn)
         ctrl_box.append(pan_up_btn)
         ctrl_box.append(pan_down_btn)
+        sliders = {}
+        for name, (value, low, high) in declared.items():
+            ctrl_box.append(Gtk.Label.new(name))
+            slider = Gtk.Scale.new_with_range(Gtk.Orientation.HORIZONTAL, low, high, (high - low) / 100)
+            slider.set_value(value)
+            slider.set_digits(2)
+            slider.set_draw_value(True)
+            slider.set_size_request(120, -1)
+            ctrl_box.append(slider)
+            sliders[name] = slider
         outer_box.append(ctrl_box)
 
-        spinner = Gtk.Spinner.new()
-        spinner.start()
-        outer_box.append(spinner)
-
         drawing_area = Gtk.DrawingArea.new()
         drawing_area.set_content_width(400)
         drawing_area.set_content_height(400)
         drawing_area.graphs = None
         drawing_area.graph_bounds = None
+        drawing_area.data_bounds = None
         drawing_area.view_bounds = None
+        # Until the user zooms or pans, the view follows the bounds as curves stream in.
+        drawing_area.view_changed = False
         drawing_area.hover_info = None
+        drawing_area.resample_source = None
+        drawing_area.compute_job = None
+        drawing_area.resample_job = None
+        # Nothing is evaluated until the graph scrolls into view (see update_visibility).
+        drawing_area.on_screen = False
+        drawing_area.evaluated = False
+        drawing_area.scroll_watch = None
+        # Parameters moved since the last frame, and the tick callback applying them.
+        drawing_area.changed_params = set()
+        drawing_area.param_tick = None
+        # Roots, extrema and intersections, found in the background once curves are complete.
+        drawing_area.features = None
+        drawing_area.feature_job = None
+        drawing_area.feature_source = None
+        # While zooming or panning, frames stretch the last render (see GraphRenderer.preview);
+        # view changes are applied once per frame and the exact frame follows when they stop.
+        drawing_area.previewing = False
+        drawing_area.pending_view = None
+        drawing_area.view_tick = None
+        drawing_area.settle_source = None
+        drawing_area.drag_origin = None
+        drawing_area.pinch_origin = None
+        drawing_area.pointer = None
+        # Messages of lines that failed to evaluate, shown in a single label below the graph.
+        drawing_area.errors = []
+        drawing_area.error_label = None
+        drawing_area.data_revision = 0
         outer_box.append(drawing_area)
 
         coords_label = Gtk.Label.new("Coordinates:")
@@ -175,187 +2343,20 @@ class GraphGeneratorExtension(NewelleExtension):
         def draw_func(area: Gtk.DrawingArea, ctx: cairo.Context, width: int, height: int, user_data):
             settings_gtk = Gtk.Settings.get_default()
             dark_theme = settings_gtk.get_property("gtk-application-prefer-dark-theme")
-            if dark_theme:
-                grid_color = (0.4, 0.4, 0.4, 1)
-                axes_color = (1, 1, 1, 1)
-                text_color = (1, 1, 1, 1)
-                palette = [
-                    (0.4, 0.8, 1.0, 1),
-                    (1.0, 0.6, 0.6, 1),
-                    (0.6, 1.0, 0.6, 1),
-                    (1.0, 0.8, 1.0, 1)
-                ]
-            else:
-                grid_color = (0.9, 0.9, 0.9, 1)
-                axes_color = (0, 0, 0, 1)
-                text_color = (0.2, 0.2, 0.2, 1)
-                palette = [
-                    (0.2, 0.6, 1.0, 1),
-                    (1.0, 0.4, 0.4, 1),
-                    (0.4, 1.0, 0.4, 1),
-                    (0.8, 0.2, 1.0, 1)
-                ]
-
-            ctx.set_operator(cairo.Operator.SOURCE)
-            ctx.set_source_rgba(0, 0, 0, 0)
-            ctx.paint()
-            ctx.set_operator(cairo.Operator.OVER)
-
-            # Draw grid using grid_density setting.
-            ctx.set_source_rgba(*grid_color)
-            ctx.set_line_width(0.5)
-            for i in range(0, width, grid_density):
-                ctx.move_to(i, 0)
-                ctx.line_to(i, height)
-            for i in range(0, height, grid_density):
-                ctx.move_to(0, i)
-                ctx.line_to(width, i)
-            ctx.stroke()
-
-            if drawing_area.graphs is None:
-                ctx.set_source_rgba(*text_color)
-                ctx.select_font_face("Sans", cairo.FontSlant.NORMAL, cairo.FontWeight.NORMAL)
-                ctx.set_font_size(20)
-                message = "Loading..."
-                extents = ctx.text_extents(message)
-                ctx.move_to((width - extents.width) / 2, (height + extents.height) / 2)
-                ctx.show_text(message)
-                return
-
-            # Compute global bounds from graphs.
-            all_x, all_y = [], []
-            for graph in drawing_area.graphs:
-                for pt in graph["points"]:
-                    all_x.append(pt[0])
-                    all_y.append(pt[1])
-            if all_x and all_y:
-                global_min_x, global_max_x = min(all_x), max(all_x)
-                global_min_y, global_max_y = min(all_y), max(all_y)
-            else:
-                global_min_x, global_max_x, global_min_y, global_max_y = -10, 10, -10, 10
-
-            margin = 0.1
-            x_range = max(abs(global_max_x - global_min_x), 1)
-            y_range = max(abs(global_max_y - global_min_y), 1)
-            global_min_x -= margin * x_range
-            global_max_x += margin * x_range
-            global_min_y -= margin * y_range
-            global_max_y += margin * y_range
-            drawing_area.graph_bounds = (global_min_x, global_max_x, global_min_y, global_max_y)
-
-            # If fixed_range is enabled, lock view_bounds to global bounds.
-            if drawing_area.view_bounds is None or fixed_range:
-                drawing_area.view_bounds = drawing_area.graph_bounds
-            view_min_x, view_max_x, view_min_y, view_max_y = drawing_area.view_bounds
-
-            def transform(x, y):
-                tx = ((x - view_min_x) / (view_max_x - view_min_x)) * width
-                ty = height - ((y - view_min_y) / (view_max_y - view_min_y)) * height
-                return tx, ty
-
-            ctx.set_source_rgba(*axes_color)
-            ctx.set_line_width(2)
-            if show_axes or (view_min_y <= 0 <= view_max_y):
-                x_axis_start = transform(view_min_x, 0)
-                x_axis_end = transform(view_max_x, 0)
-                ctx.move_to(*x_axis_start)
-                ctx.line_to(*x_axis_end)
-                ctx.stroke()
-            if show_axes or (view_min_x <= 0 <= view_max_x):
-                y_axis_start = transform(0, view_min_y)
-                y_axis_end = transform(0, view_max_y)
-                ctx.move_to(*y_axis_start)
-                ctx.line_to(*y_axis_end)
-                ctx.stroke()
-
-            # Draw graphs with optional repeat mode.
-            def draw_single_graph(graph, offset_x=0, offset_y=0):
-                pts = graph["points"]
-                color = palette[graph.get("color_index", 0) % len(palette)]
-                ctx.set_source_rgba(*color)
-                ctx.set_line_width(3)
-                first_point = True
-                prev_y = None
-                for pt in pts:
-                    x_val, y_val = pt
-                    tx, ty = transform(x_val + offset_x, y_val + offset_y)
-                    if first_point:
-                        ctx.move_to(tx, ty)
-                        first_point = False
-                    else:
-                        if prev_y is not None and abs(y_val - prev_y) > (view_max_y - view_min_y) / 4:
-                            ctx.stroke()
-                            ctx.move_to(tx, ty)
-                        else:
-                            ctx.line_to(tx, ty)
-                    prev_y = y_val
-                ctx.stroke()
-
-            # Draw original graphs.
-            for idx, graph in enumerate(drawing_area.graphs):
-                graph["color_index"] = idx
-                draw_single_graph(graph)
-
-            # If repeat mode is enabled, draw additional copies.
-            if repeat_mode != "off":
-                dx = global_max_x - global_min_x
-                dy = global_max_y - global_min_y
-                offsets = []
-                if repeat_mode in ("horizontal", "both"):
-                    offsets += [(-dx, 0), (dx, 0)]
-                if repeat_mode in ("vertical", "both"):
-                    offsets += [(0, -dy), (0, dy)]
-                # For "both" also draw diagonal copies.
-                if repeat_mode == "both":
-                    offsets += [(-dx, -dy), (-dx, dy), (dx, -dy), (dx, dy)]
-                for off in offsets:
-                    for graph in drawing_area.graphs:
-                        draw_single_graph(graph, offset_x=off[0], offset_y=off[1])
-
-            # Optionally, draw the bounding box for global bounds.
-            if show_bounding_box:
-                ctx.set_source_rgba(*axes_color)
-                ctx.set_line_width(1)
-                ctx.set_dash([4.0, 4.0])
-                top_left = transform(global_min_x, global_max_y)
-                bottom_right = transform(global_max_x, global_min_y)
-                ctx.rectangle(top_left[0], top_left[1],
-                              bottom_right[0] - top_left[0],
-                              bottom_right[1] - top_left[1])
-                ctx.stroke()
-                ctx.set_dash([])
-
-            # Draw tick labels.
-            ctx.set_source_rgba(*text_color)
-            ctx.select_font_face("Sans", cairo.FontSlant.NORMAL, cairo.FontWeight.NORMAL)
-            ctx.set_font_size(12)
-            for i in range(tick_count):
-                val = view_min_x + i * ((view_max_x - view_min_x) / (tick_count - 1))
-                tx = (i / (tick_count - 1)) * width
-                ctx.move_to(tx, height - 5)
-                ctx.line_to(tx, height)
-                ctx.stroke()
-                label = f"{val:.2f}"
-                extents = ctx.text_extents(label)
-                ctx.move_to(tx - extents.width / 2, height - 7)
-                ctx.show_text(label)
-            for i in range(tick_count):
-                val = view_min_y + i * ((view_max_y - view_min_y) / (tick_count - 1))
-                ty = height - (i / (tick_count - 1)) * height
-                ctx.move_to(0, ty)
-                ctx.line_to(5, ty)
-                ctx.stroke()
-                label = f"{val:.2f}"
-                extents = ctx.text_extents(label)
-                ctx.move_to(7, ty + extents.height / 2)
-                ctx.show_text(label)
-
-            # Draw magnetic hover point.
-            if drawing_area.hover_info:
-                pix_x, pix_y = drawing_area.hover_info['pixel']
-                ctx.set_source_rgba(*text_color)
-                ctx.arc(pix_x, pix_y, 6, 0, 2 * math.pi)
-                ctx.fill()
+            if drawing_area.graphs is not None:
+                # If fixed_range is enabled, lock view_bounds to global bounds.
+                if drawing_area.view_bounds is None or fixed_range:
+                    drawing_area.view_bounds = drawing_area.graph_bounds
+            hover_pixel = drawing_area.hover_info["pixel"] if drawing_area.hover_info else None
+            timer.frame()
+            with timer.stage("frame"):
+                if drawing_area.previewing and renderer.preview(
+                        ctx, width, height, drawing_area.view_bounds,
+                        overlay_lines=timer.summary() if debug_overlay else None):
+                    return
+                renderer.render(ctx, width, height, drawing_area.graphs, drawing_area.graph_bounds,
+                                drawing_area.view_bounds, dark_theme, hover_pixel, drawing_area.data_revision,
+                                overlay_lines=timer.summary() if debug_overlay else None)
 
         drawing_area.set_draw_func(draw_func, None)
 
@@ -364,6 +2365,10 @@ class GraphGeneratorExtension(NewelleExtension):
         drawing_area.add_controller(motion_controller)
 
         def on_motion(x, y):
+            drawing_area.pointer = (x, y)
+            if drawing_area.previewing:
+                # The curves on screen are stretched; snap again once the exact frame is drawn.
+                return
             width = drawing_area.get_allocated_width()
             height = drawing_area.get_allocated_height()
             if drawing_area.view_bounds is None or drawing_area.graphs is None:
@@ -371,31 +2376,25 @@ class GraphGeneratorExtension(NewelleExtension):
                 drawing_area.hover_info = None
                 drawing_area.queue_draw()
                 return
+            previous_hover = drawing_area.hover_info
             view_min_x, view_max_x, view_min_y, view_max_y = drawing_area.view_bounds
             math_x = view_min_x + (x / width) * (view_max_x - view_min_x)
             math_y = view_max_y - (y / height) * (view_max_y - view_min_y)
 
-            def transform(x_val, y_val):
-                tx = ((x_val - view_min_x) / (view_max_x - view_min_x)) * width
-                ty = height - ((y_val - view_min_y) / (view_max_y - view_min_y)) * height
-                return tx, ty
-
-            threshold = 10
-            snap_candidate = None
-            min_dist = threshold
-            for graph in drawing_area.graphs:
-                for pt in graph["points"]:
-                    pt_x, pt_y = pt
-                    pix_pt = transform(pt_x, pt_y)
-                    dist = math.hypot(pix_pt[0] - x, pix_pt[1] - y)
-                    if dist < min_dist:
-                        min_dist = dist
-                        snap_candidate = (pt_x, pt_y, pix_pt[0], pix_pt[1])
-            origin_pix = transform(0, 0)
-            dist_origin = math.hypot(origin_pix[0] - x, origin_pix[1] - y)
-            if dist_origin < min_dist:
-                snap_candidate = (0, 0, origin_pix[0], origin_pix[1])
-            if snap_candidate:
+            with timer.stage("hover"):
+                feature = None
+                if drawing_area.features is not None:
+                    feature = drawing_area.features.nearest(x, y, drawing_area.view_bounds, width, height,
+                                                            FEATURE_SNAP_DISTANCE)
+                snap_candidate = None
+                if feature is None:
+                    snap_candidate = snap_point(drawing_area.graphs, x, y, drawing_area.view_bounds, width, height)
+            if feature:
+                f_math_x, f_math_y, f_pix_x, f_pix_y, kind = feature
+                drawing_area.hover_info = {"math": (f_math_x, f_math_y), "pixel": (f_pix_x, f_pix_y)}
+                coords_label.set_text(
+                    f"{kind}: ({f_math_x:.6g}, {f_math_y:.6g}) | Pixel: ({f_pix_x:.0f}, {f_pix_y:.0f})")
+            elif snap_candidate:
                 s_math_x, s_math_y, s_pix_x, s_pix_y = snap_candidate
                 drawing_area.hover_info = {"math": (s_math_x, s_math_y), "pixel": (s_pix_x, s_pix_y)}
                 coords_label.set_text(
@@ -403,35 +2402,224 @@ class GraphGeneratorExtension(NewelleExtension):
             else:
                 drawing_area.hover_info = None
                 coords_label.set_text(f"Coordinates: ({math_x:.2f}, {math_y:.2f}) | Pixel: ({x:.0f}, {y:.0f})")
+            # Only the marker changes on hover; skip the frame entirely if it didn't move.
+            if drawing_area.hover_info != previous_hover:
+                drawing_area.queue_draw()
+
+        def cache_detail():
+            # The shared result cache's counters, for the debug overlay and log.
+            stats = result_cache.stats()
+            return (f"{stats['hits']} hits, {stats['disk_hits']} disk, {stats['misses']} misses, "
+                    f"{stats['entries']} entries, {stats['bytes'] / 1048576:.1f} MB")
+
+        def retraced(graph):
+            # Implicit curves are traced for a view, so they follow it whatever the settings;
+            # function curves are refined for it only with adaptive sampling (and a movable view).
+            if isinstance(graph.compiled, ShapeExpression):
+                return graph.compiled.view_dependent
+            return isinstance(graph.compiled, CompiledExpression) and adaptive_sampling and not fixed_range
+
+        def schedule_resample(delay=150):
+            if drawing_area.graphs is None or not any(retraced(graph) for graph in drawing_area.graphs):
+                return
+            # Debounce: only the last view change in a burst of clicks triggers a resample.
+            if drawing_area.resample_source is not None:
+                GLib.source_remove(drawing_area.resample_source)
+            drawing_area.resample_source = GLib.timeout_add(delay, start_resample)
+
+        def start_resample():
+            started = time.perf_counter()
+            drawing_area.resample_source = None
+            if drawing_area.resample_job is not None:
+                drawing_area.resample_job.cancel()
+            graphs = drawing_area.graphs
+            # Data series draw from their envelopes at any zoom, and parametric and polar curves
+            # don't depend on the view; function curves are resampled and implicit ones retraced.
+            curves = [graph for graph in graphs if retraced(graph)]
+            view_min_x, view_max_x, view_min_y, view_max_y = drawing_area.view_bounds
+            width = max(drawing_area.get_allocated_width(), 1)
+            height = max(drawing_area.get_allocated_height(), 1)
+            if repeat_mode != "off":
+                # Repeated copies tile the initial domain, so refine that instead of the view.
+                domain_min, domain_max = x_values[0], x_values[-1]
+            else:
+                domain_min, domain_max = view_min_x, view_max_x
+            pixels = max(int(width * (domain_max - domain_min) / (view_max_x - view_min_x)), 1)
+            y_scale = height / (view_max_y - view_min_y)
+            trace_view = drawing_area.graph_bounds if repeat_mode != "off" or fixed_range else drawing_area.view_bounds
+            keys, requests = [], []
+            for graph in curves:
+                binding = graph.compiled.bind(params)
+                if isinstance(graph.compiled, ShapeExpression):
+                    keys.append(("shape", graph.compiled.normalized, binding, trace_view, width, height))
+                    requests.append((shape_task, (graph.expr, trace_view, width, height, binding)))
+                else:
+                    keys.append(("adaptive", graph.compiled.normalized, binding, domain_min, domain_max,
+                                 pixels, y_scale, sample_budget))
+                    requests.append((resample_task, (graph.expr, domain_min, domain_max, pixels, y_scale,
+                                                     sample_budget, binding)))
+            results = []
+            for graph, key in zip(curves, keys):
+                cached = result_cache.get(key)
+                results.append(graph.resampled(*cached) if cached is not None else None)
+            missing = [idx for idx, view in enumerate(results) if view is None]
+            tasks = [requests[idx] for idx in missing]
+
+            def apply():
+                if timer.enabled:
+                    timer.record("resample", time.perf_counter() - started,
+                                 f"{sum(len(view) for view in results)} pts")
+                    timer.note("cache", cache_detail())
+                for graph, view in zip(curves, results):
+                    graph.view = view
+                drawing_area.data_revision += 1
+                drawing_area.queue_draw()
+                return False
+
+            def collect(index, result):
+                if job.cancelled or graphs is not drawing_area.graphs or isinstance(result, Exception):
+                    return False
+                idx = missing[index]
+                result_cache.put(keys[idx], *result)
+                results[idx] = curves[idx].resampled(*result)
+                if all(view is not None for view in results):
+                    return apply()
+                return False
+
+            if not tasks:
+                drawing_area.resample_job = None
+                return apply()
+            job = pool.submit(tasks, lambda index, result: GLib.idle_add(collect, index, result),
+                              is_visible=lambda: drawing_area.on_screen)
+            drawing_area.resample_job = job
+            return False
+
+        def target_view():
+            # The view the next frame will show, including changes not applied yet.
+            return drawing_area.pending_view or drawing_area.view_bounds
+
+        def pixel_to_math(bounds, x, y):
+            min_x, max_x, min_y, max_y = bounds
+            width = max(drawing_area.get_allocated_width(), 1)
+            height = max(drawing_area.get_allocated_height(), 1)
+            return min_x + x / width * (max_x - min_x), max_y - y / height * (max_y - min_y)
+
+        def move_view(bounds):
+            drawing_area.pending_view = bounds
+            if drawing_area.view_tick is None:
+                drawing_area.view_tick = drawing_area.add_tick_callback(apply_view)
+
+        def apply_view(widget, frame_clock):
+            # Runs at most once per frame however many scroll or drag events came in.
+            drawing_area.view_tick = None
+            if drawing_area.pending_view is None:
+                return False
+            drawing_area.view_bounds = drawing_area.pending_view
+            drawing_area.pending_view = None
+            drawing_area.view_changed = True
+            drawing_area.previewing = True
+            drawing_area.hover_info = None
+            drawing_area.queue_draw()
+            if drawing_area.settle_source is not None:
+                GLib.source_remove(drawing_area.settle_source)
+            drawing_area.settle_source = GLib.timeout_add(150, settle_view)
+            return False
+
+        def settle_view():
+            # The view has stopped moving: draw it exactly and refine the curves for it.
+            drawing_area.settle_source = None
+            drawing_area.previewing = False
             drawing_area.queue_draw()
+            schedule_resample(0)
+            return False
 
-        def zoom_view(factor):
+        def zoom_view(factor, anchor=None):
             if drawing_area.view_bounds is None:
                 return
-            min_x, max_x, min_y, max_y = drawing_area.view_bounds
-            center_x = (min_x + max_x) / 2
-            center_y = (min_y + max_y) / 2
-            new_range_x = (max_x - min_x) * factor / 2
-            new_range_y = (max_y - min_y) * factor / 2
-            drawing_area.view_bounds = (
-                center_x - new_range_x,
-                center_x + new_range_x,
-                center_y - new_range_y,
-                center_y + new_range_y,
-            )
-            drawing_area.queue_draw()
+            bounds = target_view()
+            if anchor is None:
+                min_x, max_x, min_y, max_y = bounds
+                anchor = ((min_x + max_x) / 2, (min_y + max_y) / 2)
+            move_view(zoom_bounds(bounds, factor, *anchor))
 
         def pan_view(delta_x, delta_y):
             if drawing_area.view_bounds is None:
                 return
-            min_x, max_x, min_y, max_y = drawing_area.view_bounds
-            drawing_area.view_bounds = (
+            min_x, max_x, min_y, max_y = target_view()
+            move_view((
                 min_x + delta_x,
                 max_x + delta_x,
                 min_y + delta_y,
                 max_y + delta_y,
-            )
-            drawing_area.queue_draw()
+            ))
+
+        def on_scroll(controller, delta_x, delta_y):
+            if drawing_area.view_bounds is None or fixed_range:
+                # Let the chat scroll instead.
+                return False
+            if drawing_area.pointer is None:
+                anchor = None
+            else:
+                anchor = pixel_to_math(target_view(), *drawing_area.pointer)
+            # One wheel notch zooms by the same factor as the buttons. Since GTK 4.8 touchpads
+            # report pixels instead, dozens per swipe event.
+            if hasattr(controller, "get_unit") and controller.get_unit() == Gdk.ScrollUnit.SURFACE:
+                delta_y /= SCROLL_PIXELS_PER_NOTCH
+            delta_y = min(max(delta_y, -1), 1)
+            zoom_view(zoom_factor ** -delta_y, anchor)
+            return True
+
+        def on_drag_begin(gesture, x, y):
+            if drawing_area.view_bounds is not None and not fixed_range:
+                drawing_area.drag_origin = target_view()
+
+        def on_drag_update(gesture, offset_x, offset_y):
+            # A second finger turns the drag into a pinch, which takes over.
+            if drawing_area.drag_origin is None or drawing_area.pinch_origin is not None:
+                return
+            min_x, max_x, min_y, max_y = drawing_area.drag_origin
+            width = max(drawing_area.get_allocated_width(), 1)
+            height = max(drawing_area.get_allocated_height(), 1)
+            shift_x = -offset_x / width * (max_x - min_x)
+            shift_y = offset_y / height * (max_y - min_y)
+            move_view((min_x + shift_x, max_x + shift_x, min_y + shift_y, max_y + shift_y))
+
+        def on_drag_end(gesture, offset_x, offset_y):
+            drawing_area.drag_origin = None
+
+        def on_pinch_begin(gesture, sequence):
+            if drawing_area.view_bounds is None or fixed_range:
+                return
+            origin = target_view()
+            found, center_x, center_y = gesture.get_bounding_box_center()
+            if not found:
+                min_x, max_x, min_y, max_y = origin
+                drawing_area.pinch_origin = (origin, ((min_x + max_x) / 2, (min_y + max_y) / 2))
+            else:
+                drawing_area.pinch_origin = (origin, pixel_to_math(origin, center_x, center_y))
+
+        def on_pinch_changed(gesture, scale):
+            if drawing_area.pinch_origin is None or scale <= 0:
+                return
+            origin, anchor = drawing_area.pinch_origin
+            move_view(zoom_bounds(origin, 1 / scale, *anchor))
+
+        def on_pinch_end(gesture, sequence):
+            drawing_area.pinch_origin = None
+
+        scroll_controller = Gtk.EventControllerScroll.new(Gtk.EventControllerScrollFlags.VERTICAL)
+        scroll_controller.connect("scroll", on_scroll)
+        drawing_area.add_controller(scroll_controller)
+        drag_gesture = Gtk.GestureDrag.new()
+        drag_gesture.connect("drag-begin", on_drag_begin)
+        drag_gesture.connect("drag-update", on_drag_update)
+        drag_gesture.connect("drag-end", on_drag_end)
+        drawing_area.add_controller(drag_gesture)
+        zoom_gesture = Gtk.GestureZoom.new()
+        zoom_gesture.connect("begin", on_pinch_begin)
+        zoom_gesture.connect("scale-changed", on_pinch_changed)
+        zoom_gesture.connect("end", on_pinch_end)
+        drawing_area.add_controller(zoom_gesture)
 
         zoom_in_btn.connect("clicked", lambda btn: zoom_view(zoom_factor))
         zoom_out_btn.connect("clicked", lambda btn: zoom_view(1 / zoom_factor))
@@ -454,56 +2642,439 @@ class GraphGeneratorExtension(NewelleExtension):
         pan_up_btn.connect("clicked", lambda btn: do_pan("up"))
         pan_down_btn.connect("clicked", lambda btn: do_pan("down"))
 
-        def compute_graph():
-            try:
-                expressions = [expr.strip() for expr in codeblock.strip().splitlines() if expr.strip()]
-                graphs = []
-                x_values = [i / 20 for i in range(-200, 201)]
-                for expr in expressions:
-                    points = []
-                    safe_locals = {
-                        "sin": math.sin,
-                        "cos": math.cos,
-                        "tan": math.tan,
-                        "sqrt": math.sqrt,
-                        "log": math.log,
-                        "abs": abs,
-                        "pi": math.pi,
-                        "e": math.e,
-                    }
-                    for x in x_values:
-                        safe_locals["x"] = x
-                        try:
-                            y = eval(expr, {"__builtins__": None}, safe_locals)
-                            if isinstance(y, (int, float)) and not math.isinf(y) and not math.isnan(y):
-                                points.append((x, y))
-                        except Exception:
-                            continue
-                    graphs.append({"expr": expr, "points": points})
-
-                def update_ui():
-                    if spinner.get_parent():
-                        spinner.stop()
-                        outer_box.remove(spinner)
-                    drawing_area.graphs = graphs
-                    if fixed_range:
-                        drawing_area.view_bounds = drawing_area.graph_bounds
-                    drawing_area.queue_draw()
+        def show_error(e):
+            # One label for every error of the current evaluation, so evaluating again
+            # (scrolling back in, a parameter change) doesn't stack up copies.
+            message = f"Error: {str(e)}"
+            if message not in drawing_area.errors:
+                drawing_area.errors.append(message)
+            if drawing_area.error_label is None:
+                drawing_area.error_label = Gtk.Label.new("")
+                outer_box.append(drawing_area.error_label)
+            drawing_area.error_label.set_text("\n".join(drawing_area.errors))
+            drawing_area.error_label.set_visible(True)
+            return False
+
+        def update_ui(graphs, added, replaced=False):
+            drawing_area.graphs = graphs
+            with timer.stage("bounds"):
+                if replaced:
+                    # Series replaced by a parameter change may have shrunk, so start over.
+                    drawing_area.data_bounds = None
+                    added = graphs
+                # Otherwise bounds only grow as curves arrive or refine, so merging the new ones is enough.
+                for graph in added:
+                    drawing_area.data_bounds = merge_bounds(drawing_area.data_bounds, graph.bounds)
+                drawing_area.graph_bounds = padded_bounds(drawing_area.data_bounds)
+            drawing_area.data_revision += 1
+            if fixed_range or not drawing_area.view_changed:
+                drawing_area.view_bounds = drawing_area.graph_bounds
+                if any(isinstance(graph.compiled, ShapeExpression) and graph.compiled.view_dependent
+                       for graph in graphs):
+                    # Implicit curves were traced for the view before the bounds grew.
+                    schedule_resample()
+            else:
+                # Replaced series lost their resampled views.
+                schedule_resample()
+            drawing_area.queue_draw()
+            return False
+
+        def trace_bounds():
+            # Before the first frame implicit curves are traced over the square the x grid spans.
+            if drawing_area.view_bounds is not None:
+                return drawing_area.view_bounds
+            return x_values[0], x_values[-1], x_values[0], x_values[-1]
+
+        def trace_size():
+            return drawing_area.get_allocated_width() or 400, drawing_area.get_allocated_height() or 400
+
+        def start_compute():
+            started = time.perf_counter()
+            drawing_area.errors = []
+            if drawing_area.error_label is not None:
+                drawing_area.error_label.set_visible(False)
+            for line in invalid_parameters(codeblock):
+                show_error(f"invalid parameter declaration: {line}")
+            entries = codeblock_entries(codeblock)
+            expressions = [source for kind, source in entries]
+            compiled = [compile_expression(expr, param_names) if kind == "expr"
+                        else None if kind in ("file", "inline") else compile_shape(expr, param_names)
+                        for kind, expr in entries]
+            bindings = [c.bind(params) if c is not None else None for c in compiled]
+            bounds, (width, height) = trace_bounds(), trace_size()
+
+            def make_series(idx, xs, ys):
+                if isinstance(compiled[idx], ShapeExpression):
+                    return PathSeries(expressions[idx], compiled[idx], xs, ys, color_index=idx)
+                return Series(expressions[idx], compiled[idx], xs, ys, color_index=idx)
+
+            # Lines already evaluated by this or another widget come straight from the cache.
+            keys = []
+            for c, binding in zip(compiled, bindings):
+                if c is None:
+                    keys.append(None)
+                elif isinstance(c, ShapeExpression):
+                    keys.append(("shape", c.normalized, binding) + ((bounds, width, height) if c.view_dependent else ()))
+                else:
+                    keys.append(("grid", c.normalized, binding, x_values[0], x_values[-1], len(x_values)))
+            samples = [result_cache.get(key) if key is not None else None for key in keys]
+            series = [make_series(idx, *sample) if sample is not None else None for idx, sample in enumerate(samples)]
+            missing = [idx for idx, sample in enumerate(samples) if sample is None and keys[idx] is not None]
+            # The rest is streamed: data blocks and shapes are loaded or traced in one task each,
+            # curves get a coarse pass first so something shows up right away, then the full
+            # grid in x chunks spread over the pool's workers.
+            tasks, owners, coarse = [], [], []
+            for idx, (kind, source) in enumerate(entries):
+                if kind in ("file", "inline"):
+                    tasks.append((data_task, (source, kind == "inline", idx)))
+                    owners.append(idx)
+                    coarse.append(False)
+                elif idx in missing and kind != "expr":
+                    tasks.append((shape_task, (source, bounds, width, height, bindings[idx])))
+                    owners.append(idx)
+                    coarse.append(False)
+            missing_curves = [idx for idx in missing if entries[idx][0] == "expr"]
+            for idx in missing_curves:
+                tasks.append((evaluate_task, (expressions[idx], x_buffer[::COARSE_STRIDE], bindings[idx])))
+                owners.append(idx)
+                coarse.append(True)
+            for idx in missing_curves:
+                for start in range(0, len(x_buffer), EVALUATION_CHUNK_SIZE):
+                    chunk = x_buffer[start:start + EVALUATION_CHUNK_SIZE]
+                    tasks.append((evaluate_task, (expressions[idx], chunk, bindings[idx])))
+                    owners.append(idx)
+                    coarse.append(False)
+            chunks = [None] * len(tasks)
+            complete = [sample is not None for sample in samples]
+
+            def publish(added):
+                if all(complete):
+                    drawing_area.compute_job = None
+                    drawing_area.evaluated = True
+                if timer.enabled and all(complete):
+                    timer.record("evaluate", time.perf_counter() - started,
+                                 f"{len(x_values) * len(missing)} pts, {len(keys) - keys.count(None) - len(missing)} cached")
+                    timer.note("cache", cache_detail())
+                update_ui([graph for graph in series if graph is not None], added)
+                if all(complete):
+                    start_features()
+                return False
+
+            def collect(index, result):
+                if job.cancelled:
                     return False
+                idx = owners[index]
+                if complete[idx]:
+                    return False
+                if isinstance(result, Exception):
+                    # Only this line is lost; the others keep streaming in.
+                    complete[idx] = True
+                    series[idx] = None
+                    show_error(result)
+                    return publish([])
+                if keys[idx] is None:
+                    complete[idx] = True
+                    series[idx] = result
+                    return publish([result])
+                if coarse[index]:
+                    series[idx] = make_series(idx, *result)
+                    return publish([series[idx]])
+                chunks[index] = result
+                parts = [chunk for chunk, owner, is_coarse in zip(chunks, owners, coarse)
+                         if owner == idx and not is_coarse]
+                if any(part is None for part in parts):
+                    return False
+                xs = concat_buffers([part[0] for part in parts])
+                ys = concat_buffers([part[1] for part in parts])
+                result_cache.put(keys[idx], xs, ys)
+                complete[idx] = True
+                series[idx] = make_series(idx, xs, ys)
+                return publish([series[idx]])
 
-                GLib.idle_add(update_ui)
-            except Exception as e:
-                def update_ui_error():
-                    if spinner.get_parent():
-                        spinner.stop()
-                        outer_box.remove(spinner)
-                    error_label = Gtk.Label.new(f"Error: {str(e)}")
-                    outer_box.append(error_label)
+            if not tasks:
+                GLib.idle_add(publish, [graph for graph in series if graph is not None])
+                return
+
+            job = pool.submit(tasks, lambda index, result: GLib.idle_add(collect, index, result),
+                              is_visible=lambda: drawing_area.on_screen)
+            drawing_area.compute_job = job
+
+        def schedule_features():
+            # Debounced like resampling, so dragging a slider doesn't search on every frame.
+            if drawing_area.feature_source is not None:
+                GLib.source_remove(drawing_area.feature_source)
+            drawing_area.feature_source = GLib.timeout_add(150, start_features)
+
+        def start_features():
+            started = time.perf_counter()
+            drawing_area.feature_source = None
+            if drawing_area.feature_job is not None:
+                drawing_area.feature_job.cancel()
+                drawing_area.feature_job = None
+            graphs = drawing_area.graphs
+            # Data series and shapes have no single y per x; features are for function curves.
+            curves = [(graph.expr, graph.compiled.bind(params)) for graph in graphs
+                      if isinstance(graph.compiled, CompiledExpression)]
+            if not curves:
+                return False
+
+            def collect(index, result):
+                if job.cancelled or graphs is not drawing_area.graphs or isinstance(result, Exception):
                     return False
+                drawing_area.features = FeatureIndex(result)
+                drawing_area.feature_job = None
+                if timer.enabled:
+                    timer.record("features", time.perf_counter() - started, f"{len(result)} points")
+                return False
+
+            job = pool.submit([(features_task, (curves, x_values[0], x_values[-1]))],
+                              lambda index, result: GLib.idle_add(collect, index, result),
+                              is_visible=lambda: drawing_area.on_screen)
+            drawing_area.feature_job = job
+            return False
+
+        def apply_params(widget, frame_clock):
+            # Runs at most once per frame however many value-changed signals came in.
+            drawing_area.param_tick = None
+            changed = drawing_area.changed_params
+            drawing_area.changed_params = set()
+            if not drawing_area.evaluated:
+                # Still streaming in: start over with the new values.
+                if drawing_area.on_screen:
+                    suspend()
+                    start_compute()
+                return False
+            with timer.stage("parameters"):
+                graphs = list(drawing_area.graphs)
+                added = []
+                for idx, graph in enumerate(graphs):
+                    if graph.compiled is None or not graph.compiled.names & changed:
+                        continue
+                    if isinstance(graph.compiled, ShapeExpression):
+                        graphs[idx] = PathSeries(graph.expr, graph.compiled,
+                                                 *graph.compiled.trace(trace_bounds(), *trace_size(), params),
+                                                 color_index=graph.color_index)
+                        added.append(graphs[idx])
+                        continue
+                    # Fresh buffers: the old ones may be shared with the result cache.
+                    updated = Series(graph.expr, graph.compiled, *graph.compiled.evaluate(x_buffer, params),
+                                     color_index=graph.color_index)
+                    if graph.view is not None:
+                        updated.view = updated.resampled(*graph.compiled.evaluate(graph.view.xs, params))
+                    graphs[idx] = updated
+                    added.append(updated)
+            if added:
+                # The old feature points no longer lie on the curves.
+                drawing_area.features = None
+                update_ui(graphs, added, replaced=True)
+                schedule_features()
+            return False
+
+        def on_param_changed(slider, name):
+            params[name] = slider.get_value()
+            drawing_area.changed_params.add(name)
+            if drawing_area.param_tick is None:
+                drawing_area.param_tick = drawing_area.add_tick_callback(apply_params)
+
+        for name, slider in sliders.items():
+            slider.connect("value-changed", on_param_changed, name)
+
+        def in_viewport():
+            if not drawing_area.get_mapped():
+                return False
+            scrolled = drawing_area.get_ancestor(Gtk.ScrolledWindow)
+            if scrolled is None:
+                return True
+            found, rect = drawing_area.compute_bounds(scrolled)
+            if not found:
+                return True
+            # Start a screen early so graphs are usually ready by the time they scroll in.
+            margin = scrolled.get_height()
+            return rect.origin.y + rect.size.height >= -margin and rect.origin.y <= scrolled.get_height() + margin
+
+        def suspend():
+            # Chunks of graphs that scrolled away are dropped; finished curves are in the cache.
+            for job in (drawing_area.compute_job, drawing_area.resample_job, drawing_area.feature_job):
+                if job is not None:
+                    job.cancel()
+            drawing_area.compute_job = None
+            drawing_area.resample_job = None
+            drawing_area.feature_job = None
+            for source in (drawing_area.resample_source, drawing_area.feature_source):
+                if source is not None:
+                    GLib.source_remove(source)
+            drawing_area.resample_source = None
+            drawing_area.feature_source = None
+            if drawing_area.settle_source is not None:
+                # Settle now; stretched frames would otherwise stay until the next gesture.
+                GLib.source_remove(drawing_area.settle_source)
+                drawing_area.settle_source = None
+                drawing_area.previewing = False
+            # Full-size layer surfaces and screen runs add up over a chat of graphs; a hidden
+            # graph keeps only its samples and paints again when it is shown.
+            renderer.release()
+            for graph in drawing_area.graphs or ():
+                graph.drop_polylines()
+
+        def update_visibility(*args):
+            visible = in_viewport()
+            if visible == drawing_area.on_screen:
+                return False
+            drawing_area.on_screen = visible
+            if not visible:
+                suspend()
+            elif not drawing_area.evaluated:
+                start_compute()
+            else:
+                if drawing_area.view_changed:
+                    schedule_resample()
+                if drawing_area.features is None:
+                    start_features()
+            return False
+
+        def release():
+            # Called on low memory: graphs that aren't visible are evaluated again when they are.
+            if drawing_area.on_screen or drawing_area.graphs is None:
+                return
+            suspend()
+            drawing_area.graphs = None
+            drawing_area.features = None
+            drawing_area.data_bounds = None
+            drawing_area.graph_bounds = None
+            drawing_area.evaluated = False
+            drawing_area.data_revision += 1
+
+        def on_map(widget):
+            # Only mapped widgets are registered: the set is extension-wide, and a callback held
+            # there would keep an otherwise dropped widget and all its series alive.
+            release_callbacks.add(release)
+            scrolled = drawing_area.get_ancestor(Gtk.ScrolledWindow)
+            if scrolled is not None:
+                adjustment = scrolled.get_vadjustment()
+                drawing_area.scroll_watch = (adjustment, adjustment.connect("value-changed", update_visibility))
+            # The allocation isn't final yet while mapping.
+            GLib.idle_add(update_visibility)
+
+        def on_unmap(widget):
+            release_callbacks.discard(release)
+            if drawing_area.scroll_watch is not None:
+                adjustment, handler = drawing_area.scroll_watch
+                adjustment.disconnect(handler)
+                drawing_area.scroll_watch = None
+            if drawing_area.on_screen:
+                drawing_area.on_screen = False
+                suspend()
+
+        def on_destroy(widget):
+            # Results for a destroyed widget would be thrown away; free the workers instead.
+            suspend()
+            release_callbacks.discard(release)
+
+        drawing_area.connect("map", on_map)
+        drawing_area.connect("unmap", on_unmap)
+        drawing_area.connect("destroy", on_destroy)
+
+        return outer_box
+
+
+GRAPH_BLOCK = re.compile(r"```graph[ \t]*\n(.*?)```", re.DOTALL)
+
+
+def render_codeblock(codeblock: str, path: str, width=400, height=400, dark_theme=False, errors=None,
+                     **settings) -> str:
+    """Render one codeblock to ``path``; the format (png, svg or pdf) follows the extension.
+
+    ``errors`` is passed on to ``evaluate_codeblock``.
+    """
+    graphs = evaluate_codeblock(codeblock, width=width, height=height, errors=errors)
+    bounds = None
+    for graph in graphs:
+        bounds = merge_bounds(bounds, graph.bounds)
+    graph_bounds = padded_bounds(bounds)
+    # Implicit curves were traced over the default range; trace them again for the final view.
+    params = {name: value for name, (value, _, _) in codeblock_parameters(codeblock).items()}
+    for graph in graphs:
+        if isinstance(graph.compiled, ShapeExpression) and graph.compiled.view_dependent:
+            graph.view = graph.resampled(*graph.compiled.trace(graph_bounds, width, height, params))
+    renderer = GraphRenderer(**settings)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".svg":
+        surface = cairo.SVGSurface(path, width, height)
+    elif extension == ".pdf":
+        surface = cairo.PDFSurface(path, width, height)
+    else:
+        surface = cairo.ImageSurface(cairo.Format.ARGB32, width, height)
+    # Vector surfaces are drawn directly so they stay vector; there is nothing to reuse anyway.
+    renderer.render(cairo.Context(surface), width, height, graphs, graph_bounds, graph_bounds, dark_theme,
+                    cached=False)
+    if extension not in (".svg", ".pdf"):
+        surface.write_to_png(path)
+    surface.finish()
+    return path
+
+
+def _render_job(job):
+    """Render one block; returns (path or None, error messages) rather than raising, so one bad
+    block doesn't stop the others."""
+    codeblock, path, options = job
+    errors = []
+    try:
+        return render_codeblock(codeblock, path, errors=errors, **options), errors
+    except Exception as e:
+        return None, errors + [str(e)]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Render graph codeblocks to image files without a display.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    render = subcommands.add_parser(
+        "render", help="Render every ```graph block of the given files (a file without blocks is one codeblock)")
+    render.add_argument("files", nargs="+")
+    render.add_argument("-o", "--output-dir", default=".")
+    render.add_argument("-f", "--format", choices=["png", "svg", "pdf"], default="png")
+    render.add_argument("--width", type=int, default=400)
+    render.add_argument("--height", type=int, default=400)
+    render.add_argument("--dark", action="store_true", help="Use the dark theme colors")
+    render.add_argument("--tick-count", type=int, default=7)
+    render.add_argument("--grid-density", type=int, default=20)
+    render.add_argument("--repeat-mode", choices=["off", "horizontal", "vertical", "both"], default="off")
+    render.add_argument("--bounding-box", action="store_true")
+    render.add_argument("-j", "--jobs", type=int, default=1, help="Render this many files in parallel")
+    args = parser.parse_args(argv)
 
-                GLib.idle_add(update_ui_error)
+    options = {
+        "width": args.width,
+        "height": args.height,
+        "dark_theme": args.dark,
+        "tick_count": args.tick_count,
+        "grid_density": args.grid_density,
+        "repeat_mode": args.repeat_mode,
+        "show_bounding_box": args.bounding_box,
+    }
+    jobs = []
+    for file in args.files:
+        with open(file, encoding="utf-8") as f:
+            text = f.read()
+        blocks = GRAPH_BLOCK.findall(text) or [text]
+        stem = os.path.splitext(os.path.basename(file))[0]
+        for n, block in enumerate(blocks, 1):
+            name = f"{stem}-{n}.{args.format}" if len(blocks) > 1 else f"{stem}.{args.format}"
+            jobs.append((block, os.path.join(args.output_dir, name), options))
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.jobs > 1:
+        with ProcessPoolExecutor(args.jobs) as executor:
+            results = list(executor.map(_render_job, jobs))
+    else:
+        results = [_render_job(job) for job in jobs]
+    status = 0
+    for (_, target, _), (path, errors) in zip(jobs, results):
+        for error in errors:
+            print(f"{target}: {error}", file=sys.stderr)
+            status = 1
+        if path is not None:
+            print(path)
+    return status
 
-        thread = threading.Thread(target=compute_graph, daemon=True)
-        thread.start()
 
-        return outer_box
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())